@@ -1,6 +1,6 @@
 {
     'name': 'Gestión Profesional de Tarifas Logísticas',
-    'version': '19.0.5.0.0',
+    'version': '19.0.6.0.0',
     'author': 'Alphaqueb Consulting',
     'category': 'Operations/Logistics',
     'summary': 'Control histórico de tarifas y catálogo editable de fletes marítimos',
@@ -14,9 +14,17 @@
         'security/ir.model.access.csv',
         'data/partner_category_data.xml',
         'data/tarifario_month_data.xml',
+        'data/tarifario_kpi_data.xml',
+        'data/tarifario_cron_data.xml',
         'views/tarifario_views.xml',
         'views/tarifario_nacional_views.xml',
         'views/purchase_order_views.xml',
+        'views/costing_queue_views.xml',
+        'views/route_sync_queue_views.xml',
+        'views/tarifario_history_views.xml',
+        'views/instrumentation_views.xml',
+        'wizard/tarifario_import_views.xml',
+        'wizard/tarifario_archive_views.xml',
         'views/tarifario_menus.xml',
         'views/dashboard_kpi.xml',
     ],
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""Rellena los datos derivados que introdujo esta versión sobre las tarifas
+ya existentes: el rango de vigencia (valid_from/valid_to, y con él el
+estado), la expansión por mes (freight.tariff.validity) y el snapshot de
+KPIs del dashboard."""
+import logging
+
+from odoo import api, SUPERUSER_ID
+from odoo.tools import SQL
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    env = api.Environment(cr, SUPERUSER_ID, {'active_test': False})
+    Tariff = env['freight.tariff']
+
+    tariffs = Tariff.search([])
+    for fname in ('valid_from', 'valid_to'):
+        env.add_to_compute(Tariff._fields[fname], tariffs)
+    Tariff.flush_model()
+
+    env['freight.tariff.validity']._sync_where(SQL('TRUE'))
+    env['freight.tariff.kpi']._rebuild()
+    _logger.info(
+        "[TARIFARIO] Migración %s: vigencias, expansión por mes y snapshot de KPIs "
+        "reconstruidos para %s tarifa(s).", version, len(tariffs),
+    )
@@ -1,4 +1,11 @@
+from . import tarifario_instrumentation
 from . import res_partner
 from . import tarifario_master
 from . import purchase_integration
 from . import tarifario_nacional
+from . import tarifario_kpi
+from . import queue_mixin
+from . import costing_queue
+from . import route_sync_queue
+from . import tarifario_validity
+from . import tarifario_history
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Cola DIFERIDA del recálculo ALL-IN tras validar recepciones.
+
+Modo opcional (parámetro de sistema ``logistica_tarifario.costing_deferred``):
+la validación de la recepción solo escribe los datos de la última compra en
+el producto y encola la plantilla; el cron drena la cola por bloques, fuera
+de la transacción del almacén (ver freight.tariff.queue.mixin).
+"""
+import logging
+
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+COSTING_DEFERRED_PARAM = 'logistica_tarifario.costing_deferred'
+
+
+class FreightTariffCostingQueue(models.Model):
+    _name = 'freight.tariff.costing.queue'
+    _inherit = ['freight.tariff.queue.mixin']
+    _description = 'Cola de recálculo ALL-IN'
+    _order = 'id'
+
+    _queue_deferred_param = COSTING_DEFERRED_PARAM
+    _queue_cron_xmlid = 'logistica_tarifario.ir_cron_costing_queue'
+
+    product_tmpl_id = fields.Many2one(
+        'product.template', string='Producto', required=True,
+        ondelete='cascade', readonly=True,
+    )
+
+    # Una entrada por producto: volver a encolar no duplica (dedup).
+    _product_tmpl_uniq = models.UniqueIndex('(product_tmpl_id)')
+    _state_idx = models.Index('(state, id)')
+
+    @api.model
+    def _enqueue(self, templates):
+        """Encola (o re-activa) las plantillas sin esperar al cron que drena
+        la cola (ver _enqueue_keys para la única espera posible)."""
+        if not templates:
+            return
+        self._enqueue_keys(['product_tmpl_id'], [(tmpl_id,) for tmpl_id in templates.ids])
+        _logger.info(
+            "[TARIFARIO_PO] Recálculo ALL-IN diferido: %s producto(s) encolados.",
+            len(templates),
+        )
+
+    @api.model
+    def _queue_ready(self):
+        if hasattr(self.env['product.template'], '_compute_costo_all_in'):
+            return True
+        _logger.warning(
+            "[TARIFARIO_PO] Cola ALL-IN: el motor de costos no está "
+            "instalado; las entradas se conservan.")
+        return False
+
+    def _process_entry(self):
+        self.product_tmpl_id.sudo()._compute_costo_all_in()
+
+    def _queue_entry_label(self):
+        return self.product_tmpl_id.display_name
@@ -14,9 +14,13 @@ Flujo de la regla de negocio:
    ALL-IN (motor de inventory_shopping_cart, invocado de forma defensiva).
 """
 import logging
+from collections import defaultdict
 
 from odoo import models, fields, api
 
+from .route_sync_queue import som_schedule_route_sync
+from .tarifario_instrumentation import instrumented, lazy_display_names
+
 _logger = logging.getLogger(__name__)
 
 # El default del producto es 1.0 (placeholder sin significado operativo):
@@ -24,6 +28,29 @@ _logger = logging.getLogger(__name__)
 _CAPACITY_UNSET_THRESHOLD = 1.0
 
 
+def _som_write_template_targets(templates, targets):
+    """Escritura SET-BASED del costeo: compara el estado destino de cada
+    plantilla ({tmpl_id: {campo: valor}}) con su valor actual y escribe solo
+    la diferencia, UNA escritura por grupo de plantillas con valores
+    idénticos. Devuelve [(plantillas, vals)] de lo escrito."""
+    groups = defaultdict(list)
+    for tmpl in templates:
+        vals = {}
+        for field, value in targets[tmpl.id].items():
+            current = tmpl[field]
+            if (current.id if isinstance(current, models.BaseModel) else current) != value:
+                vals[field] = value
+        if vals:
+            groups[tuple(sorted(vals.items()))].append(tmpl)
+    written = []
+    for vals_key, tmpls in groups.items():
+        group = templates.browse([t.id for t in tmpls])
+        vals = dict(vals_key)
+        group.write(vals)
+        written.append((group, vals))
+    return written
+
+
 class PurchaseOrder(models.Model):
     _inherit = 'purchase.order'
 
@@ -146,32 +173,32 @@ class PurchaseOrder(models.Model):
         string='Navieras con tarifa',
     )
 
-    @api.depends('som_route_country_id', 'som_route_forwarder_id', 'som_route_pol_id')
+    @api.depends('som_route_country_id', 'som_route_forwarder_id', 'som_route_pol_id',
+                 'som_route_etd')
+    @instrumented('purchase.order._compute_som_route_domains')
     def _compute_som_route_domains(self):
         """El tarifario es la ÚNICA fuente: cascada país → forwarder →
         POL → POD. Si el forwarder solo tiene un puerto tarifado, esa es la
-        única opción."""
+        única opción.
+
+        Con ETD capturado, la cascada usa las tarifas vigentes EN ESA FECHA
+        (una consulta por lote sobre el índice de vigencia); sin ETD, el
+        catálogo vigente cacheado."""
         Tariff = self.env['freight.tariff'].sudo()
-        tariffs = Tariff.search([('state', '=', 'active')])
+        current = Tariff._get_route_availability_index()
+        by_etd = Tariff._get_route_availability_index_by_date(self.mapped('som_route_etd'))
         for order in self:
-            order.som_allowed_country_ids = [(6, 0, tariffs.mapped('country_id').ids)]
-            by_country = (
-                tariffs.filtered(lambda t: t.country_id == order.som_route_country_id)
-                if order.som_route_country_id else tariffs
-            )
-            order.som_allowed_forwarder_ids = [(6, 0, by_country.mapped('forwarder_id').ids)]
-            by_fwd = (
-                by_country.filtered(lambda t: t.forwarder_id == order.som_route_forwarder_id)
-                if order.som_route_forwarder_id else by_country
-            )
-            order.som_allowed_naviera_ids = [(6, 0, by_fwd.mapped('naviera_id').ids)]
-            order.som_allowed_pol_ids = [(6, 0, by_fwd.mapped('pol_id').ids)]
-            by_pol = (
-                by_fwd.filtered(lambda t: t.pol_id == order.som_route_pol_id)
-                if order.som_route_pol_id else by_fwd
-            )
-            order.som_allowed_pod_ids = [(6, 0, by_pol.mapped('pod_id').ids)]
-
+            index = by_etd.get(order.som_route_etd, current)
+            country = order.som_route_country_id.id or None
+            fwd = order.som_route_forwarder_id.id or None
+            pol = order.som_route_pol_id.id or None
+            order.som_allowed_country_ids = [(6, 0, index['countries'])]
+            order.som_allowed_forwarder_ids = [(6, 0, index['forwarders'].get(country, ()))]
+            order.som_allowed_naviera_ids = [(6, 0, index['navieras'].get((country, fwd), ()))]
+            order.som_allowed_pol_ids = [(6, 0, index['pols'].get((country, fwd), ()))]
+            order.som_allowed_pod_ids = [(6, 0, index['pods'].get((country, fwd, pol), ()))]
+
+    @instrumented('purchase.order._som_apply_costing_update')
     def _som_apply_costing_update(self, products=None, naviera=False,
                                    forwarder=False, pol=False, pod=False):
         """NÚCLEO del costeo automático: escribe en los productos de esta OC
@@ -184,8 +211,11 @@ class PurchaseOrder(models.Model):
         - Validación de recepción SOLO en flujos sin torre de control
           (compras nacionales / recepciones directas).
         """
-        Picking = self.env['stock.picking']
-        templates = self.env['product.template'].sudo()
+        Template = self.env['product.template'].sudo()
+        tf = Template._fields
+        product_ids = set(products.ids) if products else None
+        targets = {}  # tmpl_id -> {campo: valor destino}; la última OC manda
+        sources = {}  # tmpl_id -> OC de la última compra
         lines_to_activate = self.env['purchase.order.line'].sudo()
         for order in self:
             route_pol = pol or order.som_route_pol_id
@@ -193,39 +223,48 @@ class PurchaseOrder(models.Model):
             for line in order.order_line:
                 if line.display_type or not line.product_id:
                     continue
-                if products and line.product_id.product_tmpl_id.id not in products.ids:
+                tmpl_id = line.product_id.product_tmpl_id.id
+                if product_ids is not None and tmpl_id not in product_ids:
                     continue
-                tmpl = line.product_id.product_tmpl_id.sudo()
-                tf = tmpl._fields
-                vals = {}
-                if order.som_route_country_id and 'x_origin_country_id' in tf                         and tmpl.x_origin_country_id != order.som_route_country_id:
-                    vals['x_origin_country_id'] = order.som_route_country_id.id
-                if route_pol and 'x_pol_id' in tf and tmpl.x_pol_id != route_pol:
-                    vals['x_pol_id'] = route_pol.id
-                if route_pod and 'x_pod_id' in tf and tmpl.x_pod_id != route_pod:
-                    vals['x_pod_id'] = route_pod.id
-                if (line.som_container_capacity or 0.0) > 0 and 'x_container_capacity' in tf                         and tmpl.x_container_capacity != line.som_container_capacity:
-                    vals['x_container_capacity'] = line.som_container_capacity
-                if (line.som_arancel_pct or 0.0) > 0 and 'x_arancel_pct' in tf                         and tmpl.x_arancel_pct != line.som_arancel_pct:
-                    vals['x_arancel_pct'] = line.som_arancel_pct
+                target = targets.setdefault(tmpl_id, {})
+                sources[tmpl_id] = order
+                if order.som_route_country_id and 'x_origin_country_id' in tf:
+                    target['x_origin_country_id'] = order.som_route_country_id.id
+                if route_pol and 'x_pol_id' in tf:
+                    target['x_pol_id'] = route_pol.id
+                if route_pod and 'x_pod_id' in tf:
+                    target['x_pod_id'] = route_pod.id
+                if (line.som_container_capacity or 0.0) > 0 and 'x_container_capacity' in tf:
+                    target['x_container_capacity'] = line.som_container_capacity
+                if (line.som_arancel_pct or 0.0) > 0 and 'x_arancel_pct' in tf:
+                    target['x_arancel_pct'] = line.som_arancel_pct
 
                 # ÚLTIMA OPERACIÓN MANDA (igual que la ruta): naviera y
                 # forwarder se escriben INDEPENDIENTES — nunca quedan vacíos
                 # si el dato existe. La protección del costo vive en el
                 # promedio ponderado máximo, no aquí.
-                if naviera and 'x_naviera_id' in tf and tmpl.x_naviera_id != naviera:
-                    vals['x_naviera_id'] = naviera.id
-                if forwarder and 'x_forwarder_id' in tf and tmpl.x_forwarder_id != forwarder:
-                    vals['x_forwarder_id'] = forwarder.id
+                if naviera and 'x_naviera_id' in tf:
+                    target['x_naviera_id'] = naviera.id
+                if forwarder and 'x_forwarder_id' in tf:
+                    target['x_forwarder_id'] = forwarder.id
+                lines_to_activate |= line
 
-                if vals:
-                    tmpl.with_context(skip_costing_recompute=True).write(vals)
-                    _logger.info(
+        # Plantillas repetidas en varias OC se escriben UNA vez (estado final)
+        # y en bloque, agrupadas por valores idénticos.
+        templates = Template.browse(targets)
+        written = _som_write_template_targets(
+            templates.with_context(skip_costing_recompute=True), targets)
+        _logger.info(
+            "[TARIFARIO_PO] Costeo: %s producto(s) actualizados con la última compra.",
+            sum(len(group) for group, _vals in written),
+        )
+        if _logger.isEnabledFor(logging.DEBUG):
+            for group, vals in written:
+                for tmpl in group:
+                    _logger.debug(
                         "[TARIFARIO_PO] Costeo %s: producto %s ← %s",
-                        order.name, tmpl.display_name, vals,
+                        sources[tmpl.id].name, tmpl.display_name, vals,
                     )
-                templates |= tmpl
-                lines_to_activate |= line
 
         # ACTIVACIÓN: estas compras ya cuentan para el promedio ponderado
         # (el disparador — publicar o recibir — ya ocurrió).
@@ -237,7 +276,7 @@ class PurchaseOrder(models.Model):
             templates._compute_costo_all_in()
             _logger.info(
                 "[TARIFARIO_PO] Costo ALL-IN recalculado para: %s",
-                templates.mapped('display_name'),
+                lazy_display_names(templates),
             )
         return templates
 
@@ -279,61 +318,113 @@ class PurchaseOrder(models.Model):
             vals['shipment_type'] = self.som_transport_type
         return vals
 
+    @instrumented('purchase.order._som_propagate_route_to_shipments')
     def _som_propagate_route_to_shipments(self):
         """VAIVÉN OC → embarque: refleja la ruta del tarifario en los
-        embarques del portal y en las recepciones abiertas."""
-        for order in self.with_context(som_carrier_sync=True):
-            picking_vals = {}
+        embarques del portal y en las recepciones abiertas.
+
+        Por LOTE (p. ej. una naviera que rola el buque en 300 OC): UN search
+        de recepciones y UNO de proformas para todas las OC, las proformas y
+        embarques faltantes se crean en un solo create, y las escrituras se
+        agrupan por valores idénticos. Todo bajo el guard som_carrier_sync."""
+        orders = self.with_context(som_carrier_sync=True)
+        position = {order.id: i for i, order in enumerate(orders)}
+
+        # Recepciones abiertas de las OC (por purchase_id o por la carga del
+        # portal). Si una recepción cuelga de dos OC del lote, se aplican en
+        # el orden del lote: la última manda, como al propagar OC por OC.
+        picking_vals_by_order = {}
+        for order in orders:
+            vals = {}
             if order.som_route_forwarder_id:
-                picking_vals['som_forwarder_id'] = order.som_route_forwarder_id.id
+                vals['som_forwarder_id'] = order.som_route_forwarder_id.id
             if order.som_route_naviera_id:
-                picking_vals['som_naviera_id'] = order.som_route_naviera_id.id
-            if picking_vals:
-                pickings = self.env['stock.picking'].sudo().search([
-                    '|',
-                    ('purchase_id', '=', order.id),
-                    ('supplier_cargo_po_id', '=', order.id),
-                    ('picking_type_code', '=', 'incoming'),
-                    ('state', 'not in', ('done', 'cancel')),
-                ])
-                if pickings:
-                    pickings.with_context(som_carrier_sync=True).write(picking_vals)
-
-            if 'supplier.proforma.header' not in self.env:
-                continue
-
-            Header = self.env['supplier.proforma.header'].sudo()
-            headers = Header.search([('purchase_id', '=', order.id)])
-
-            # La ruta capturada en la OC debe vivir en un EMBARQUE desde el
-            # primer momento: si la OC aún no tiene proforma/embarque, se
-            # crean por default aquí — no se espera a que el usuario o el
-            # portal los generen para que la información se propague.
-            has_route_data = any(order[f] for f in self.SOM_ROUTE_SYNC_FIELDS)
-            if has_route_data:
-                if not headers:
-                    headers = Header.create({'purchase_id': order.id})
-                if 'supplier.shipment' in self.env \
-                        and not headers.mapped('shipment_ids'):
-                    self.env['supplier.shipment'].sudo().with_context(
-                        som_carrier_sync=True, skip_date_sync=True,
-                    ).create({'proforma_id': headers[0].id})
-
-            for shipment in headers.mapped('shipment_ids'):
+                vals['som_naviera_id'] = order.som_route_naviera_id.id
+            if vals:
+                picking_vals_by_order[order.id] = vals
+        if picking_vals_by_order:
+            order_ids = list(picking_vals_by_order)
+            pickings = self.env['stock.picking'].sudo().search([
+                '|',
+                ('purchase_id', 'in', order_ids),
+                ('supplier_cargo_po_id', 'in', order_ids),
+                ('picking_type_code', '=', 'incoming'),
+                ('state', 'not in', ('done', 'cancel')),
+            ])
+            groups = defaultdict(list)
+            for picking in pickings:
+                owners = sorted(
+                    {picking.purchase_id.id, picking.supplier_cargo_po_id.id}
+                    & picking_vals_by_order.keys(),
+                    key=position.get,
+                )
+                vals = {}
+                for order_id in owners:
+                    vals.update(picking_vals_by_order[order_id])
+                vals = {f: v for f, v in vals.items() if picking[f].id != v}
+                if vals:
+                    groups[tuple(sorted(vals.items()))].append(picking.id)
+            for vals_key, picking_ids in groups.items():
+                pickings.browse(picking_ids).with_context(
+                    som_carrier_sync=True).write(dict(vals_key))
+
+        if 'supplier.proforma.header' not in self.env:
+            return
+
+        Header = self.env['supplier.proforma.header'].sudo()
+        headers = Header.search([('purchase_id', 'in', orders.ids)])
+        headers_by_order = defaultdict(lambda: Header)
+        for header in headers:
+            headers_by_order[header.purchase_id.id] |= header
+
+        # La ruta capturada en la OC debe vivir en un EMBARQUE desde el
+        # primer momento: si la OC aún no tiene proforma/embarque, se
+        # crean por default aquí — no se espera a que el usuario o el
+        # portal los generen para que la información se propague.
+        with_route = orders.filtered(
+            lambda o: any(o[f] for f in self.SOM_ROUTE_SYNC_FIELDS))
+        missing = [o.id for o in with_route if not headers_by_order[o.id]]
+        if missing:
+            created = Header.create([{'purchase_id': oid} for oid in missing])
+            for header in created:
+                headers_by_order[header.purchase_id.id] = header
+            headers |= created
+        if 'supplier.shipment' not in self.env:
+            return
+
+        Shipment = self.env['supplier.shipment'].sudo().with_context(
+            som_carrier_sync=True, skip_date_sync=True)
+        headers.shipment_ids  # precarga de los embarques de todo el lote
+        without_shipment = [
+            headers_by_order[o.id][0].id for o in with_route
+            if not headers_by_order[o.id].shipment_ids
+        ]
+        if without_shipment:
+            Shipment.create([{'proforma_id': hid} for hid in without_shipment])
+
+        groups = defaultdict(list)
+        for order in orders:
+            for shipment in headers_by_order[order.id].shipment_ids:
                 ship_vals = order._som_shipment_vals_from_route(shipment)
                 if ship_vals:
-                    shipment.with_context(
-                        som_carrier_sync=True, skip_date_sync=True,
-                    ).write(ship_vals)
+                    groups[tuple(sorted(ship_vals.items()))].append(shipment.id)
+        for vals_key, shipment_ids in groups.items():
+            Shipment.browse(shipment_ids).write(dict(vals_key))
+
+    def _som_flush_route_sync(self):
+        """Salida de la cola de sincronización (route_sync_queue)."""
+        self._som_propagate_route_to_shipments()
 
     def write(self, vals):
         res = super().write(vals)
         # VAIVÉN de la ruta completa (forwarder, naviera, POL, POD, ETD y
         # tipo de transporte): capturada en la OC → se refleja en sus
-        # recepciones abiertas y en los embarques del portal. Guard anti-bucle.
+        # recepciones abiertas y en los embarques del portal. Se encola y se
+        # propaga por lote al cerrar la transacción (o por cron en modo
+        # diferido). Guard anti-bucle.
         if not self.env.context.get('som_carrier_sync') \
                 and any(f in vals for f in self.SOM_ROUTE_SYNC_FIELDS):
-            self._som_propagate_route_to_shipments()
+            som_schedule_route_sync(self)
         return res
 
     @api.onchange('partner_id')
@@ -441,7 +532,7 @@ class PurchaseOrderLine(models.Model):
                 tmpl.sudo().with_context(skip_costing_recompute=True).write(vals)
                 _logger.info(
                     "[TARIFARIO_PO] Línea %s propagó a producto %s (vacío, sin "
-                    "recálculo): %s", line.id, tmpl.display_name, vals,
+                    "recálculo): %s", line.id, lazy_display_names(tmpl), vals,
                 )
 
     @api.model_create_multi
@@ -477,29 +568,64 @@ class StockPicking(models.Model):
     def write(self, vals):
         res = super().write(vals)
         # VAIVÉN del Forwarder/Naviera: capturado en la RECEPCIÓN → se refleja
-        # en la OC (forwarder de la ruta) y en el embarque del portal.
+        # en la OC (forwarder de la ruta) y en el embarque del portal. Se
+        # encola como el de la OC (route_sync_queue).
         if (
             ('som_forwarder_id' in vals or 'som_naviera_id' in vals)
             and not self.env.context.get('som_carrier_sync')
         ):
-            for picking in self.with_context(som_carrier_sync=True):
-                po = picking._som_resolve_purchase_order()
-                if po and picking.som_forwarder_id and 'som_route_forwarder_id' in po._fields:
-                    if po.som_route_forwarder_id != picking.som_forwarder_id:
-                        po.sudo().with_context(som_carrier_sync=True).write(
-                            {'som_route_forwarder_id': picking.som_forwarder_id.id})
-                shipment = getattr(picking, 'supplier_shipment_id', False)
-                if shipment:
-                    ship_vals = {}
-                    if picking.som_forwarder_id and 'forwarder_id' in shipment._fields                             and shipment.forwarder_id != picking.som_forwarder_id:
-                        ship_vals['forwarder_id'] = picking.som_forwarder_id.id
-                    if picking.som_naviera_id and 'naviera_id' in shipment._fields                             and shipment.naviera_id != picking.som_naviera_id:
-                        ship_vals['naviera_id'] = picking.som_naviera_id.id
-                        ship_vals['shipping_line'] = picking.som_naviera_id.name
-                    if ship_vals:
-                        shipment.sudo().with_context(som_carrier_sync=True).write(ship_vals)
+            som_schedule_route_sync(self)
         return res
 
+    def _som_flush_route_sync(self):
+        """Salida de la cola de sincronización: recepción → OC y embarque, por
+        lote. Se junta el estado FINAL de cada OC y embarque (la última
+        recepción del lote manda, igual que escribir una por una) y se
+        escribe solo la diferencia, agrupando los registros con valores
+        idénticos."""
+        if not self:
+            return
+        purchase_orders = self._som_resolve_purchase_orders()
+        has_shipment = 'supplier_shipment_id' in self._fields
+        po_targets = {}    # po -> forwarder
+        ship_targets = {}  # shipment -> {campo: valor destino}
+        for picking in self:
+            forwarder = picking.som_forwarder_id
+            naviera = picking.som_naviera_id
+            po = purchase_orders[picking.id]
+            if po and forwarder and 'som_route_forwarder_id' in po._fields:
+                po_targets[po] = forwarder
+            shipment = picking.supplier_shipment_id if has_shipment else False
+            if shipment:
+                target = ship_targets.setdefault(shipment, {})
+                if forwarder and 'forwarder_id' in shipment._fields:
+                    target['forwarder_id'] = forwarder
+                if naviera and 'naviera_id' in shipment._fields:
+                    target['naviera_id'] = naviera
+
+        po_writes = defaultdict(list)
+        for po, forwarder in po_targets.items():
+            if po.som_route_forwarder_id != forwarder:
+                po_writes[forwarder.id].append(po.id)
+        PurchaseOrder = self.env['purchase.order'].sudo().with_context(som_carrier_sync=True)
+        for forwarder_id, po_ids in po_writes.items():
+            PurchaseOrder.browse(po_ids).write({'som_route_forwarder_id': forwarder_id})
+
+        ship_writes = defaultdict(list)
+        for shipment, target in ship_targets.items():
+            ship_vals = {}
+            if 'forwarder_id' in target and shipment.forwarder_id != target['forwarder_id']:
+                ship_vals['forwarder_id'] = target['forwarder_id'].id
+            if 'naviera_id' in target and shipment.naviera_id != target['naviera_id']:
+                ship_vals['naviera_id'] = target['naviera_id'].id
+                ship_vals['shipping_line'] = target['naviera_id'].name
+            if ship_vals:
+                ship_writes[tuple(sorted(ship_vals.items()))].append(shipment.id)
+        if ship_writes:
+            Shipment = self.env['supplier.shipment'].sudo().with_context(som_carrier_sync=True)
+            for vals_key, shipment_ids in ship_writes.items():
+                Shipment.browse(shipment_ids).write(dict(vals_key))
+
     def _action_done(self):
         res = super()._action_done()
         try:
@@ -512,72 +638,143 @@ class StockPicking(models.Model):
             )
         return res
 
+    def _som_resolve_purchase_orders(self):
+        """OC de cada recepción cuando los moves no traen purchase_line_id:
+        {picking_id: purchase.order (vacío si no hay)}. Cadena defensiva:
+        purchase_id nativo → OC de la carga (portal multi-PO) → OC del viaje
+        de la Torre de Control, este último con UNA búsqueda para todas las
+        recepciones que siguen sin OC."""
+        result = {}
+        unresolved = []
+        for picking in self:
+            po = getattr(picking, 'purchase_id', False) \
+                or getattr(picking, 'supplier_cargo_po_id', False)
+            if po:
+                result[picking.id] = po
+            else:
+                unresolved.append(picking.id)
+        voyage_pos = {}
+        if unresolved and 'stock.transit.voyage' in self.env:
+            voyages = self.env['stock.transit.voyage'].sudo().search(
+                [('reception_picking_id', 'in', unresolved)])
+            for voyage in voyages:
+                # Primer viaje de cada recepción (el mismo que daba limit=1).
+                voyage_pos.setdefault(voyage.reception_picking_id.id, voyage.purchase_id)
+        empty = self.env['purchase.order']
+        for picking_id in unresolved:
+            result[picking_id] = voyage_pos.get(picking_id) or empty
+        return result
+
     def _som_resolve_purchase_order(self):
-        """OC de esta recepción cuando los moves no traen purchase_line_id.
-        Cadena defensiva: purchase_id nativo → OC de la carga (portal
-        multi-PO) → OC del viaje de la Torre de Control."""
+        """OC de esta recepción (ver _som_resolve_purchase_orders)."""
         self.ensure_one()
-        po = getattr(self, 'purchase_id', False)
-        if po:
-            return po
-        po = getattr(self, 'supplier_cargo_po_id', False)
-        if po:
-            return po
-        if 'stock.transit.voyage' in self.env:
-            voyage = self.env['stock.transit.voyage'].sudo().search(
-                [('reception_picking_id', '=', self.id)], limit=1)
-            if voyage and voyage.purchase_id:
-                return voyage.purchase_id
-        return self.env['purchase.order']
+        return self._som_resolve_purchase_orders()[self.id]
 
     def _som_tariff_all_in(self, country, pol, pod, naviera=False, forwarder=False):
         """All-in de la tarifa activa que MEJOR corresponde a la combinación
         (más específica primero). 0.0 si no hay tarifa."""
+        key = (country.id if country else None, pol.id if pol else None,
+               pod.id if pod else None, naviera.id if naviera else None,
+               forwarder.id if forwarder else None)
+        return self._som_tariff_all_in_bulk([key])[key]
+
+    @api.model
+    def _som_tariff_all_in_bulk(self, keys):
+        """Resolución por LOTE de _som_tariff_all_in: recibe todas las llaves
+        (country_id, pol_id, pod_id, naviera_id, forwarder_id) de un lote de
+        recepciones (ids o None) y devuelve {llave: all_in}, reutilizable por
+        el llamador durante todo el lote.
+
+        Precedencia (la de siempre): tarifas de la ruta país/POL/POD, de la
+        más reciente a la más antigua; con naviera gana la de esa naviera y,
+        entre ellas, la del forwarder. Todo sale del catálogo vigente
+        cacheado: a lo sumo UNA lectura para el lote completo."""
         Tariff = self.env['freight.tariff'].sudo()
-        domain = [('state', '=', 'active')]
-        if country:
-            domain.append(('country_id', '=', country.id))
-        if pol:
-            domain.append(('pol_id', '=', pol.id))
-        if pod:
-            domain.append(('pod_id', '=', pod.id))
-        candidates = Tariff.search(domain, order='create_date desc')
-        if naviera:
-            nav = candidates.filtered(lambda t: t.naviera_id == naviera)
-            if forwarder:
-                navf = nav.filtered(lambda t: t.forwarder_id == forwarder)
-                nav = navf or nav
-            candidates = nav or candidates
-        return candidates[:1].all_in or 0.0
-
-    def _som_apply_carrier_most_expensive(self, picking, order, tmpl):
+        result = {}
+        for key in set(keys):
+            country_id, pol_id, pod_id, naviera_id, forwarder_id = key
+            candidates = Tariff._get_active_tariffs_by_route(
+                country_id or None, pol_id or None, pod_id or None)
+            if naviera_id:
+                nav = [t for t in candidates if t.naviera_id == naviera_id]
+                if forwarder_id:
+                    navf = [t for t in nav if t.forwarder_id == forwarder_id]
+                    nav = navf or nav
+                candidates = nav or candidates
+            result[key] = candidates[0].all_in if candidates else 0.0
+        return result
+
+    def _som_picking_carriers(self):
+        """Naviera/forwarder de cada recepción en cascada recepción → embarque
+        del portal, resueltos UNA vez por recepción y con los embarques del
+        lote precargados en bloque: {picking_id: (naviera, forwarder)}."""
+        has_shipment = 'supplier_shipment_id' in self._fields
+        if has_shipment:
+            shipments = self.mapped('supplier_shipment_id')
+            shipments.fetch([f for f in ('naviera_id', 'forwarder_id') if f in shipments._fields])
+        carriers = {}
+        for picking in self:
+            shipment = picking.supplier_shipment_id if has_shipment else False
+            carriers[picking.id] = (
+                picking.som_naviera_id or (
+                    getattr(shipment, 'naviera_id', False) if shipment else False),
+                picking.som_forwarder_id or (
+                    getattr(shipment, 'forwarder_id', False) if shipment else False),
+            )
+        return carriers
+
+    def _som_carrier_targets(self, picking, order, carriers=None):
+        """Naviera/forwarder de la ÚLTIMA operación recibida — independientes
+        (forwarder sin naviera también cuenta), en cascada de fuentes:
+        recepción → embarque del portal → propia OC. {campo: partner}.
+
+        :param carriers: resultado de _som_picking_carriers() del lote, para
+            no volver a resolver la recepción en cada move"""
+        if carriers is None:
+            carriers = picking._som_picking_carriers()
+        new_nav, new_fwd = carriers[picking.id]
+        if not new_fwd and 'som_route_forwarder_id' in order._fields:
+            new_fwd = order.som_route_forwarder_id
+        targets = {}
+        if new_nav:
+            targets['x_naviera_id'] = new_nav
+        if new_fwd:
+            targets['x_forwarder_id'] = new_fwd
+        return targets
+
+    def _som_apply_carrier_most_expensive(self, picking, order, tmpl, carriers=None):
         """Naviera/forwarder de la ÚLTIMA operación recibida — independientes
         (forwarder sin naviera también cuenta) y nunca dejan el producto
         vacío si el dato existe en la recepción, el embarque del portal o la
         propia OC (cascada de fuentes)."""
         tf = tmpl._fields
-        shipment = getattr(picking, 'supplier_shipment_id', False)
-        new_nav = picking.som_naviera_id or (
-            getattr(shipment, 'naviera_id', False) if shipment else False)
-        new_fwd = picking.som_forwarder_id or (
-            getattr(shipment, 'forwarder_id', False) if shipment else False
-        ) or (order.som_route_forwarder_id
-              if 'som_route_forwarder_id' in order._fields else False)
-
-        vals = {}
-        if new_nav and 'x_naviera_id' in tf and tmpl.x_naviera_id != new_nav:
-            vals['x_naviera_id'] = new_nav.id
-        if new_fwd and 'x_forwarder_id' in tf and tmpl.x_forwarder_id != new_fwd:
-            vals['x_forwarder_id'] = new_fwd.id
-        return vals
+        return {
+            field: partner.id
+            for field, partner in self._som_carrier_targets(picking, order, carriers).items()
+            if field in tf and tmpl[field] != partner
+        }
 
+    @instrumented('stock.picking._som_update_products_from_last_purchase')
     def _som_update_products_from_last_purchase(self):
         """Disparador de RECEPCIÓN: cualquier recepción validada hacia una
         ubicación INTERNA (existencias) — con o sin torre de control, se haya
         publicado o no. Junto con la PUBLICACIÓN del inventario en tránsito,
         son los ÚNICOS dos momentos que actualizan el costo (regla estricta:
-        ni la captura del portal ni la validación de tránsito lo hacen)."""
-        templates_to_recompute = self.env['product.template'].sudo()
+        ni la captura del portal ni la validación de tránsito lo hacen).
+
+        Set-based: primero se junta el estado FINAL de cada producto (la
+        última compra del lote manda, igual que escribir move por move),
+        luego se escribe solo la diferencia agrupando productos con valores
+        idénticos, y las líneas de OC se activan en una sola escritura."""
+        Template = self.env['product.template'].sudo()
+        tf = Template._fields
+        targets = {}  # tmpl_id -> {campo: valor destino}
+        sources = {}  # tmpl_id -> (recepción, OC) de la última compra
+        lines_to_activate = self.env['purchase.order.line'].sudo()
+        # Transportista por recepción: resuelto una vez para todo el lote; por
+        # move solo quedan lookups de diccionario.
+        carriers = self._som_picking_carriers()
+        purchase_orders = self._som_resolve_purchase_orders()
 
         for picking in self:
             if picking.state != 'done':
@@ -592,59 +789,76 @@ class StockPicking(models.Model):
                     "interna.", picking.name, picking.location_dest_id.usage,
                 )
                 continue
-            fallback_po = picking._som_resolve_purchase_order()
+            fallback_po = purchase_orders[picking.id]
+            # Recepciones SIN vínculo directo en el move (p. ej. las generadas
+            # por la Torre de Control): la línea se resuelve por producto
+            # dentro de la OC de la recepción (primera línea del producto).
+            fallback_lines = {}
+            for line in fallback_po.order_line:
+                if not line.display_type and line.product_id:
+                    fallback_lines.setdefault(line.product_id.id, line)
+            carrier_vals = {}  # order_id -> {campo: partner_id}
             for move in picking.move_ids:
                 if not move.product_id:
                     continue
-                po_line = getattr(move, 'purchase_line_id', False)
-                if not po_line and fallback_po:
-                    # Recepciones SIN vínculo directo en el move (p. ej. las
-                    # generadas por la Torre de Control): se resuelve la línea
-                    # por producto dentro de la OC de la recepción.
-                    po_line = fallback_po.order_line.filtered(
-                        lambda l, m=move: not l.display_type
-                        and l.product_id == m.product_id
-                    )[:1]
+                po_line = getattr(move, 'purchase_line_id', False) \
+                    or fallback_lines.get(move.product_id.id)
                 if not po_line:
                     continue
-                if not po_line.som_costing_activated:
-                    po_line.sudo().write({'som_costing_activated': True})
+                lines_to_activate |= po_line
                 order = po_line.order_id
-                tmpl = move.product_id.product_tmpl_id.sudo()
-                tf = tmpl._fields
-                vals = {}
+                tmpl_id = move.product_id.product_tmpl_id.id
+                target = targets.setdefault(tmpl_id, {})
+                sources[tmpl_id] = (picking, order)
 
                 if order.som_route_country_id and 'x_origin_country_id' in tf:
-                    if tmpl.x_origin_country_id != order.som_route_country_id:
-                        vals['x_origin_country_id'] = order.som_route_country_id.id
+                    target['x_origin_country_id'] = order.som_route_country_id.id
                 if order.som_route_pol_id and 'x_pol_id' in tf:
-                    if tmpl.x_pol_id != order.som_route_pol_id:
-                        vals['x_pol_id'] = order.som_route_pol_id.id
+                    target['x_pol_id'] = order.som_route_pol_id.id
                 if order.som_route_pod_id and 'x_pod_id' in tf:
-                    if tmpl.x_pod_id != order.som_route_pod_id:
-                        vals['x_pod_id'] = order.som_route_pod_id.id
+                    target['x_pod_id'] = order.som_route_pod_id.id
                 if (po_line.som_container_capacity or 0.0) > 0 and 'x_container_capacity' in tf:
-                    if tmpl.x_container_capacity != po_line.som_container_capacity:
-                        vals['x_container_capacity'] = po_line.som_container_capacity
+                    target['x_container_capacity'] = po_line.som_container_capacity
                 if (po_line.som_arancel_pct or 0.0) > 0 and 'x_arancel_pct' in tf:
-                    if tmpl.x_arancel_pct != po_line.som_arancel_pct:
-                        vals['x_arancel_pct'] = po_line.som_arancel_pct
+                    target['x_arancel_pct'] = po_line.som_arancel_pct
+                if order.id not in carrier_vals:
+                    carrier_vals[order.id] = {
+                        field: partner.id
+                        for field, partner in self._som_carrier_targets(
+                            picking, order, carriers).items()
+                        if field in tf
+                    }
+                target.update(carrier_vals[order.id])
 
-                vals.update(self._som_apply_carrier_most_expensive(picking, order, tmpl))
+        pending = lines_to_activate.filtered(lambda l: not l.som_costing_activated)
+        if pending:
+            pending.write({'som_costing_activated': True})
 
-                if vals:
-                    tmpl.write(vals)
-                    _logger.info(
+        templates_to_recompute = Template.browse(targets)
+        written = _som_write_template_targets(templates_to_recompute, targets)
+        _logger.info(
+            "[TARIFARIO_PO] Recepción: %s producto(s) actualizados con la última compra.",
+            sum(len(group) for group, _vals in written),
+        )
+        if _logger.isEnabledFor(logging.DEBUG):
+            for group, vals in written:
+                for tmpl in group:
+                    picking, order = sources[tmpl.id]
+                    _logger.debug(
                         "[TARIFARIO_PO] Recepción %s: producto %s actualizado "
                         "con la última compra (%s): %s",
                         picking.name, tmpl.display_name, order.name, vals,
                     )
-                templates_to_recompute |= tmpl
 
-        # Recalcular el costo ALL-IN (motor de inventory_shopping_cart).
-        if templates_to_recompute and hasattr(templates_to_recompute, '_compute_costo_all_in'):
+        # Recalcular el costo ALL-IN (motor de inventory_shopping_cart). En
+        # modo diferido solo se encola: el cron lo recalcula fuera de la
+        # transacción de la recepción.
+        Queue = self.env['freight.tariff.costing.queue'].sudo()
+        if templates_to_recompute and Queue._is_deferred():
+            Queue._enqueue(templates_to_recompute)
+        elif templates_to_recompute and hasattr(templates_to_recompute, '_compute_costo_all_in'):
             templates_to_recompute._compute_costo_all_in()
             _logger.info(
                 "[TARIFARIO_PO] Costo ALL-IN recalculado para: %s",
-                templates_to_recompute.mapped('display_name'),
+                lazy_display_names(templates_to_recompute),
             )
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""Base común de las colas diferidas del tarifario (costeo ALL-IN y
+sincronización de ruta).
+
+Cada cola es una tabla con una entrada por llave (INSERT … ON CONFLICT DO
+NOTHING: encolar dos veces no duplica ni espera al cron), drenada por su
+cron en bloques con SKIP LOCKED; cada bloque corre en su savepoint y, si falla, se reintenta entrada
+por entrada para aislar al culpable. Las fallidas quedan visibles y
+reintentables. La cola concreta solo define su llave y _process_entry.
+"""
+import logging
+import traceback
+
+from odoo import models, fields, api
+from odoo.tools import SQL
+
+_logger = logging.getLogger(__name__)
+
+# Intentos automáticos antes de dejar la entrada como 'Fallida'.
+_MAX_ATTEMPTS = 3
+
+
+class FreightTariffQueueMixin(models.AbstractModel):
+    _name = 'freight.tariff.queue.mixin'
+    _description = 'Cola diferida del Tarifario'
+
+    # Parámetro de sistema que activa el modo diferido y cron que drena la
+    # cola (xmlid); los define cada cola.
+    _queue_deferred_param = None
+    _queue_cron_xmlid = None
+
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('failed', 'Fallida'),
+    ], string='Estado', default='pending', required=True, readonly=True)
+    attempts = fields.Integer(string='Intentos', readonly=True)
+    last_error = fields.Text(string='Último error', readonly=True)
+
+    @api.model
+    def _is_deferred(self):
+        return bool(self.env['ir.config_parameter'].sudo().get_param(self._queue_deferred_param))
+
+    @api.model
+    def _enqueue_keys(self, columns, rows):
+        """Encola (o re-activa) las llaves ``rows`` (tuplas de ``columns``,
+        las del índice único) sin esperar al cron: un INSERT … ON CONFLICT
+        DO NOTHING (una entrada existente no se toca, ni se bloquea) y un
+        UPDATE que re-activa solo las no pendientes que nadie tiene tomadas
+        (SKIP LOCKED). Una entrada ya pendiente no se reescribe.
+
+        Única espera posible: por una llave que otra transacción insertó o
+        borró (el cron, al terminar su bloque) sin confirmar aún; el INSERT
+        necesita saber si ese cambio se confirma para no duplicarla."""
+        if not rows:
+            return
+        uid = self.env.uid
+        table = SQL.identifier(self._table)
+        keys = SQL(', ').join(SQL.identifier(col) for col in columns)
+        values = SQL(', ').join(SQL('(%s)', SQL(', ').join(row)) for row in rows)
+        self.env.cr.execute(SQL("""
+            INSERT INTO %(table)s
+                (%(columns)s, state, attempts, create_uid, create_date, write_uid, write_date)
+            SELECT %(keys)s, 'pending', 0, %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+              FROM (VALUES %(rows)s) AS k(%(columns)s)
+            ON CONFLICT (%(columns)s) DO NOTHING
+        """,
+            table=table,
+            columns=keys,
+            keys=SQL(', ').join(SQL.identifier('k', col) for col in columns),
+            rows=values,
+            uid=uid,
+        ))
+        self.env.cr.execute(SQL("""
+            UPDATE %(table)s
+               SET state = 'pending', attempts = 0, last_error = NULL,
+                   write_uid = %(uid)s, write_date = NOW() AT TIME ZONE 'UTC'
+             WHERE id IN (
+                SELECT q.id
+                  FROM %(table)s q
+                  JOIN (VALUES %(rows)s) AS k(%(columns)s) ON %(match)s
+                 WHERE q.state <> 'pending'
+                   FOR UPDATE OF q SKIP LOCKED
+             )
+        """,
+            table=table,
+            columns=keys,
+            rows=values,
+            match=SQL(' AND ').join(
+                SQL('%s = %s', SQL.identifier('q', col), SQL.identifier('k', col))
+                for col in columns
+            ),
+            uid=uid,
+        ))
+        self.invalidate_model()
+        self._trigger_cron()
+
+    @api.model
+    def _trigger_cron(self):
+        cron = self.env.ref(self._queue_cron_xmlid, raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+
+    @api.model
+    def _queue_ready(self):
+        """False si la cola no puede procesarse aún (sus entradas se
+        conservan)."""
+        return True
+
+    @api.model
+    def _cron_process_queue(self, batch_size=100):
+        """Drena la cola por bloques: cada bloque se procesa en su propio
+        savepoint y se confirma; si el bloque falla, se reintenta entrada
+        por entrada para aislar al culpable."""
+        if not self._queue_ready():
+            return
+        last_id = 0
+        while True:
+            self.env.cr.execute(SQL("""
+                SELECT id FROM %s
+                 WHERE state = 'pending' AND id > %s
+              ORDER BY id
+                 LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+            """, SQL.identifier(self._table), last_id, batch_size))
+            entries = self.browse(row[0] for row in self.env.cr.fetchall())
+            if not entries:
+                break
+            last_id = entries[-1].id
+            entries._process()
+            self.env['ir.cron']._commit_progress(
+                len(entries),
+                remaining=self.search_count([('state', '=', 'pending'), ('id', '>', last_id)]),
+            )
+
+    def _process(self):
+        try:
+            with self.env.cr.savepoint():
+                self._process_entry()
+                self.env.flush_all()
+        except Exception:
+            if len(self) > 1:
+                for entry in self:
+                    entry._process()
+                return
+            self._register_failure(traceback.format_exc())
+            return
+        self.unlink()
+
+    def _process_entry(self):
+        """Procesa las entradas de ``self`` (un bloque completo o una sola
+        entrada en el reintento). Lo implementa cada cola."""
+        raise NotImplementedError()
+
+    def _queue_entry_label(self):
+        """Descripción de la entrada para el log de fallos."""
+        return self.display_name
+
+    def _register_failure(self, error):
+        self.ensure_one()
+        attempts = self.attempts + 1
+        self.write({
+            'attempts': attempts,
+            'last_error': error,
+            'state': 'failed' if attempts >= _MAX_ATTEMPTS else 'pending',
+        })
+        _logger.error(
+            "[TARIFARIO_PO] %s falló para %s (intento %s/%s): %s",
+            self._description, self._queue_entry_label(), attempts, _MAX_ATTEMPTS, error,
+        )
+
+    def action_retry(self):
+        """Re-encola las entradas fallidas (o pendientes) seleccionadas."""
+        self.write({'state': 'pending', 'attempts': 0, 'last_error': False})
+        self._trigger_cron()
+        return True
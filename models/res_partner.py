@@ -1,4 +1,5 @@
-from odoo import api, models
+from odoo import api, models, tools
+from odoo.exceptions import MissingError
 
 # Etiquetas del tarifario y su xmlid de datos (data/partner_category_data.xml)
 TARIFARIO_TAG_XMLIDS = {
@@ -14,15 +15,49 @@ class ResPartner(models.Model):
 
     @api.model
     def _tarifario_get_tag(self, tag_name):
-        """Resuelve la categoría del tarifario: xmlid → por nombre → la crea."""
+        """Resuelve la categoría del tarifario: xmlid → por nombre → la crea.
+        La resolución se cachea por registro (_tarifario_get_tag_id): sin
+        consultas extra por cada guardado."""
         Category = self.env['res.partner.category']
+        try:
+            return Category.browse(self._tarifario_get_tag_id(tag_name))
+        except MissingError:
+            pass
+        tag = Category.sudo().create({'name': tag_name})
+        # El 'no existe' nunca se cachea, así que no hay nada que invalidar;
+        # solo si esta transacción se revierte hay que descartar el id que la
+        # siguiente resolución haya cacheado.
+        self.env.cr.postrollback.add(self.env.registry.clear_cache)
+        return Category.browse(tag.id)
+
+    @api.model
+    @tools.ormcache('tag_name')
+    def _tarifario_get_tag_id(self, tag_name):
+        """Id de la categoría (xmlid → por nombre). Si no existe levanta
+        MissingError, que el ormcache no guarda: solo se cachean categorías
+        reales."""
+        Category = self.env['res.partner.category'].sudo()
         xmlid = TARIFARIO_TAG_XMLIDS.get(tag_name)
         tag = xmlid and self.env.ref(xmlid, raise_if_not_found=False)
         if not tag:
             tag = Category.search([('name', '=', tag_name)], limit=1)
         if not tag:
-            tag = Category.sudo().create({'name': tag_name})
-        return tag
+            raise MissingError(tag_name)
+        return tag.id
+
+    @api.model
+    def _tarifario_assign_tags(self, partner_ids_by_tag):
+        """Etiquetado en lote {nombre de etiqueta: ids de partner}: UNA
+        resolución y UNA escritura por etiqueta, solo para los partners
+        distintos que aún no la tienen."""
+        for tag_name, partner_ids in partner_ids_by_tag.items():
+            partners = self.browse({pid for pid in partner_ids if pid})
+            if not partners:
+                continue
+            tag = self._tarifario_get_tag(tag_name)
+            missing = partners.filtered(lambda p: tag not in p.category_id)
+            if missing:
+                missing.write({'category_id': [(4, tag.id)]})
 
     @api.model_create_multi
     def create(self, vals_list):
@@ -37,3 +72,22 @@ class ResPartner(models.Model):
             if missing:
                 missing.sudo().write({'category_id': [(4, tag.id)]})
         return partners
+
+
+class ResPartnerCategory(models.Model):
+    _inherit = 'res.partner.category'
+
+    def unlink(self):
+        # Solo si se borra una etiqueta del tarifario hay una resolución
+        # cacheada que descartar (caso excepcional: son datos del módulo).
+        Partner = self.env['res.partner']
+        cached_ids = set()
+        for tag_name in TARIFARIO_TAG_XMLIDS:
+            try:
+                cached_ids.add(Partner._tarifario_get_tag_id(tag_name))
+            except MissingError:
+                pass
+        res = super().unlink()
+        if cached_ids.intersection(self.ids):
+            self.env.registry.clear_cache()
+        return res
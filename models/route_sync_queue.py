@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Bandeja de salida (outbox) del VAIVÉN de la ruta OC ↔ recepción ↔ embarque.
+
+Guardar una OC o una recepción ya no propaga en el acto: el registro queda
+marcado como "sucio" y las ediciones repetidas del mismo registro se
+fusionan en una sola propagación.
+
+- Modo normal: se propaga por lote al cerrar la transacción (precommit).
+- Modo DIFERIDO (parámetro ``logistica_tarifario.route_sync_deferred``): el
+  registro se encola aquí y el cron lo propaga por bloques, fuera de la
+  transacción del usuario (guardado rápido, menos esperas de bloqueo sobre
+  supplier.shipment).
+"""
+from odoo import SUPERUSER_ID, models, fields, api
+
+ROUTE_SYNC_DEFERRED_PARAM = 'logistica_tarifario.route_sync_deferred'
+
+
+def som_schedule_route_sync(records):
+    """Marca ``records`` (purchase.order o stock.picking) para propagar su
+    ruta: a la cola persistente en modo diferido o, si no, al precommit de la
+    transacción — un solo lote por modelo, con las ediciones fusionadas."""
+    if not records:
+        return
+    Queue = records.env['freight.tariff.route.sync.queue'].sudo()
+    if Queue._is_deferred():
+        Queue._enqueue(records)
+        return
+    cr = records.env.cr
+    precommit = cr.precommit
+    key = f'logistica_tarifario.route_sync.{records._name}'
+    pending = precommit.data.get(key)
+    if pending is None:
+        pending = precommit.data[key] = {}
+        model = records._name
+
+        def flush_route_sync():
+            # La propagación es del sistema (igual que en el cron diferido):
+            # superusuario y context limpio, no el env de quien escribió
+            # primero en la transacción.
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            ids = list(precommit.data.pop(key, {}))
+            env[model].browse(ids).exists()._som_flush_route_sync()
+            env.flush_all()
+
+        precommit.add(flush_route_sync)
+
+    # La última edición va al final: en el lote, la última manda.
+    for record_id in records.ids:
+        pending.pop(record_id, None)
+        pending[record_id] = None
+
+
+class FreightTariffRouteSyncQueue(models.Model):
+    _name = 'freight.tariff.route.sync.queue'
+    _inherit = ['freight.tariff.queue.mixin']
+    _description = 'Cola de sincronización de ruta'
+    _order = 'id'
+
+    _queue_deferred_param = ROUTE_SYNC_DEFERRED_PARAM
+    _queue_cron_xmlid = 'logistica_tarifario.ir_cron_route_sync_queue'
+
+    res_model = fields.Selection([
+        ('purchase.order', 'Orden de compra'),
+        ('stock.picking', 'Recepción'),
+    ], string='Modelo', required=True, readonly=True)
+    res_id = fields.Many2oneReference(
+        string='Registro', model_field='res_model', required=True, readonly=True)
+
+    # Una entrada por registro: las ediciones repetidas se fusionan.
+    _record_uniq = models.UniqueIndex('(res_model, res_id)')
+    _state_idx = models.Index('(state, id)')
+
+    @api.model
+    def _enqueue(self, records):
+        if records:
+            self._enqueue_keys(
+                ['res_model', 'res_id'], [(records._name, rec_id) for rec_id in records.ids])
+
+    @api.model
+    def _cron_process_queue(self, batch_size=200):
+        return super()._cron_process_queue(batch_size=batch_size)
+
+    def _process_entry(self):
+        # Un lote por modelo.
+        for model in set(self.mapped('res_model')):
+            ids = [e.res_id for e in self if e.res_model == model]
+            self.env[model].sudo().browse(ids).exists()._som_flush_route_sync()
+
+    def _queue_entry_label(self):
+        return f'{self.res_model},{self.res_id}'
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""Histórico FRÍO del tarifario (solo inserción).
+
+Al expirar (cron de cambio de mes) o al archivarse, cada tarifa deja aquí
+una fila compacta: llaves de la ruta, periodo, equipo y vector de costos.
+Sin mail.thread ni columnas de auditoría, y la tabla va PARTICIONADA por
+año (una partición por anio): el análisis año contra año poda particiones
+y nunca toca freight_tariff. Las particiones se crean en init() y en el
+cron anual, nunca dentro de una transacción de usuario.
+"""
+import logging
+from datetime import date
+
+from odoo import models, fields, api
+from odoo.tools import SQL
+
+from .tarifario_master import _COST_FIELDS, _MESES_NOMBRES, _anio_int_sql
+
+_logger = logging.getLogger(__name__)
+
+_TABLE = 'freight_tariff_history'
+_DEFAULT_PARTITION = f'{_TABLE}_default'
+
+
+class FreightTariffHistory(models.Model):
+    _name = 'freight.tariff.history'
+    _description = 'Histórico de Tarifas'
+    _auto = False          # tabla particionada: la crea init()
+    _log_access = False
+    _order = 'anio desc, id desc'
+
+    tariff_ref = fields.Integer(string='Tarifa origen', readonly=True)
+    reason = fields.Selection([
+        ('expired', 'Expirada'),
+        ('archived', 'Archivada'),
+    ], string='Motivo', readonly=True)
+    recorded_on = fields.Date(string='Registrada', readonly=True)
+
+    country_id = fields.Many2one('res.country', string='País', readonly=True)
+    forwarder_id = fields.Many2one('res.partner', string='Forwarder', readonly=True)
+    naviera_id = fields.Many2one('res.partner', string='Naviera', readonly=True)
+    pol_id = fields.Many2one('res.partner', string='POL', readonly=True)
+    pod_id = fields.Many2one('res.partner', string='POD', readonly=True)
+    equipo = fields.Char(string='Equipo', readonly=True)
+
+    # Periodo: año (0 = año no numérico) y meses de vigencia como máscara de
+    # bits (bit 0 = enero … bit 11 = diciembre).
+    anio = fields.Integer(string='Año', readonly=True)
+    mes_mask = fields.Integer(string='Meses (máscara)', readonly=True)
+
+    costo_exw = fields.Float(string='Costo EXW', readonly=True)
+    ocean_freight = fields.Float(string='Ocean Freight', readonly=True)
+    ams_imo = fields.Float(string='AMS + IMO', readonly=True)
+    lib_seguro = fields.Float(string='Lib + Seguro', readonly=True)
+    maniobras = fields.Float(string='Maniobras', readonly=True)
+    vacio_lavado = fields.Float(string='Vacío + Lavado', readonly=True)
+    aa = fields.Float(string='AA (Agencia Aduanal)', readonly=True)
+    flete_terrestre = fields.Float(string='Flete Terrestre', readonly=True)
+    profepa = fields.Float(string='PROFEPA', readonly=True)
+    uva = fields.Float(string='UVA', readonly=True)
+    fee = fields.Float(string='FEE', readonly=True)
+    all_in = fields.Float(string='Total ALL IN', readonly=True)
+    transit_time = fields.Integer(string='Transit Time (días)', readonly=True)
+
+    def init(self):
+        """Crea la tabla particionada (RANGE por anio), su partición por
+        defecto, los índices y las particiones anuales conocidas."""
+        self.env.cr.execute(SQL("""
+            CREATE TABLE IF NOT EXISTS %(table)s (
+                id SERIAL,
+                tariff_ref INTEGER,
+                reason VARCHAR NOT NULL,
+                recorded_on DATE NOT NULL DEFAULT CURRENT_DATE,
+                country_id INTEGER REFERENCES res_country (id) ON DELETE SET NULL,
+                forwarder_id INTEGER REFERENCES res_partner (id) ON DELETE SET NULL,
+                naviera_id INTEGER REFERENCES res_partner (id) ON DELETE SET NULL,
+                pol_id INTEGER REFERENCES res_partner (id) ON DELETE SET NULL,
+                pod_id INTEGER REFERENCES res_partner (id) ON DELETE SET NULL,
+                equipo VARCHAR,
+                anio INTEGER NOT NULL,
+                mes_mask INTEGER NOT NULL DEFAULT 0,
+                %(costs)s,
+                all_in NUMERIC,
+                transit_time INTEGER,
+                PRIMARY KEY (id, anio)
+            ) PARTITION BY RANGE (anio)
+        """,
+            table=SQL.identifier(_TABLE),
+            costs=SQL(', ').join(SQL('%s NUMERIC', SQL.identifier(col)) for col in _COST_FIELDS),
+        ))
+        self.env.cr.execute(SQL(
+            "CREATE TABLE IF NOT EXISTS %s PARTITION OF %s DEFAULT",
+            SQL.identifier(_DEFAULT_PARTITION), SQL.identifier(_TABLE),
+        ))
+        # Una fila por tarifa y año (idempotente ante expirar + archivar), y
+        # la llave de la ruta para las consultas de tendencia.
+        self.env.cr.execute(SQL(
+            "CREATE UNIQUE INDEX IF NOT EXISTS %s ON %s (tariff_ref, anio)",
+            SQL.identifier(f'{_TABLE}_tariff_anio_uniq'), SQL.identifier(_TABLE),
+        ))
+        self.env.cr.execute(SQL(
+            "CREATE INDEX IF NOT EXISTS %s ON %s (pol_id, pod_id, equipo, anio)",
+            SQL.identifier(f'{_TABLE}_route_idx'), SQL.identifier(_TABLE),
+        ))
+        self._ensure_partitions(self._partition_years())
+        # Siembra: lo ya expirado o archivado antes de instalar el histórico.
+        self._record_tariffs(
+            SQL("(ft.state = 'expired' OR ft.active = false)"),
+            SQL("CASE WHEN ft.active THEN 'expired' ELSE 'archived' END"),
+        )
+
+    @api.model
+    def _partition_years(self):
+        """Años que necesitan partición: los del tarifario, los estacionados
+        en la partición por defecto, el año en curso y el siguiente."""
+        year = _anio_int_sql(SQL('anio'))
+        self.env.cr.execute(SQL(
+            "SELECT DISTINCT %s FROM freight_tariff UNION SELECT DISTINCT anio FROM %s",
+            year, SQL.identifier(_DEFAULT_PARTITION),
+        ))
+        today = date.today()
+        return {row[0] for row in self.env.cr.fetchall() if row[0]} | {today.year, today.year + 1}
+
+    @api.model
+    def _ensure_partitions(self, years):
+        """Crea las particiones anuales que falten. Crear una partición junto
+        a la DEFAULT toma bloqueos fuertes sobre la tabla: solo se llama
+        desde init() y el cron anual. Si la DEFAULT ya guarda filas del año,
+        se mueven a la tabla nueva antes de adjuntarla como partición."""
+        cr = self.env.cr
+        table = SQL.identifier(_TABLE)
+        default = SQL.identifier(_DEFAULT_PARTITION)
+        for year in sorted(set(years)):
+            if not year or year < 1:
+                continue
+            name = f'{_TABLE}_y{year}'
+            cr.execute("SELECT to_regclass(%s)", (name,))
+            if cr.fetchone()[0]:
+                continue
+            partition = SQL.identifier(name)
+            cr.execute(SQL("SELECT 1 FROM %s WHERE anio = %s LIMIT 1", default, year))
+            if not cr.fetchone():
+                cr.execute(SQL(
+                    "CREATE TABLE %s PARTITION OF %s FOR VALUES FROM (%s) TO (%s)",
+                    partition, table, year, year + 1,
+                ))
+                continue
+            cr.execute(SQL(
+                "CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS)",
+                partition, table,
+            ))
+            cr.execute(SQL("""
+                WITH moved AS (DELETE FROM %(default)s WHERE anio = %(year)s RETURNING *)
+                INSERT INTO %(partition)s SELECT * FROM moved
+            """, default=default, year=year, partition=partition))
+            cr.execute(SQL(
+                "ALTER TABLE %s ATTACH PARTITION %s FOR VALUES FROM (%s) TO (%s)",
+                table, partition, year, year + 1,
+            ))
+            _logger.info("[TARIFARIO] Histórico: partición %s creada con las filas de %s.", name, year)
+
+    @api.model
+    def _cron_ensure_partitions(self):
+        """Cron anual: particiones del año en curso, del siguiente y de los
+        años que hayan caído en la partición por defecto."""
+        self._ensure_partitions(self._partition_years())
+
+    @api.model
+    def _record_tariffs(self, where, reason):
+        """Copia al histórico las tarifas que cumplen ``where`` (SQL sobre el
+        alias ft) con UN INSERT … SELECT; las ya registradas para ese año se
+        conservan tal cual (solo inserción). ``reason`` es el motivo o una
+        expresión SQL que lo calcula por fila. Un año sin partición cae en
+        la DEFAULT hasta que el cron anual la cree."""
+        mes_field = self.env['freight.tariff']._fields['mes_ids']
+        costs = SQL(', ').join(SQL.identifier(col) for col in _COST_FIELDS)
+        self.env.cr.execute(SQL("""
+            INSERT INTO %(table)s
+                (tariff_ref, reason, country_id, forwarder_id, naviera_id,
+                 pol_id, pod_id, equipo, anio, mes_mask, %(costs)s, all_in, transit_time)
+            SELECT ft.id, %(reason)s, ft.country_id, ft.forwarder_id, ft.naviera_id,
+                   ft.pol_id, ft.pod_id, ft.equipo, %(year)s,
+                   COALESCE((
+                       SELECT BIT_OR(1 << (m.code::int - 1))
+                         FROM %(rel)s rel
+                         JOIN freight_tariff_month m ON m.id = rel.%(col2)s
+                        WHERE rel.%(col1)s = ft.id AND m.code ~ '^(0?[1-9]|1[0-2])$'
+                   ), 0),
+                   %(ft_costs)s, ft.all_in, ft.transit_time
+              FROM freight_tariff ft
+             WHERE %(where)s
+            ON CONFLICT (tariff_ref, anio) DO NOTHING
+        """,
+            table=SQL.identifier(_TABLE),
+            costs=costs,
+            reason=reason,
+            year=SQL('COALESCE(%s, 0)', _anio_int_sql(SQL('ft.anio'))),
+            rel=SQL.identifier(mes_field.relation),
+            col1=SQL.identifier(mes_field.column1),
+            col2=SQL.identifier(mes_field.column2),
+            ft_costs=SQL(', ').join(SQL.identifier('ft', col) for col in _COST_FIELDS),
+            where=where,
+        ))
+        count = self.env.cr.rowcount
+        if count:
+            _logger.info("[TARIFARIO] Histórico: %s tarifa(s) registradas (%s).", count, reason)
+        return count
+
+    @api.model
+    def _record(self, tariffs, reason):
+        if not tariffs:
+            return 0
+        tariffs.flush_recordset()
+        return self._record_tariffs(SQL('ft.id IN %s', tuple(tariffs.ids)), reason)
+
+    @api.model
+    def get_historical_trend(self, pol_id=None, pod_id=None, equipo=None,
+                             anio_desde=None, anio_hasta=None):
+        """Tendencia histórica por ruta y equipo: un punto por (año, mes) de
+        vigencia con conteo y ALL-IN / Ocean promedio, mínimo y máximo.
+
+        Solo lee el histórico; el rango de años poda particiones. Un valor
+        vacío no filtra ese campo."""
+        self.check_access('read')
+        conditions = [SQL('TRUE')]
+        if pol_id:
+            conditions.append(SQL('h.pol_id = %s', int(pol_id)))
+        if pod_id:
+            conditions.append(SQL('h.pod_id = %s', int(pod_id)))
+        if equipo:
+            conditions.append(SQL('h.equipo = %s', equipo))
+        if anio_desde:
+            conditions.append(SQL('h.anio >= %s', int(anio_desde)))
+        if anio_hasta:
+            conditions.append(SQL('h.anio <= %s', int(anio_hasta)))
+        self.env.cr.execute(SQL("""
+            SELECT h.anio, m.mes,
+                   COUNT(*) AS count,
+                   AVG(COALESCE(h.all_in, 0)) AS avg_all_in,
+                   AVG(COALESCE(h.ocean_freight, 0)) AS avg_ocean,
+                   MIN(h.all_in) AS min_all_in,
+                   MAX(h.all_in) AS max_all_in
+              FROM %(table)s h
+              JOIN generate_series(1, 12) AS m(mes) ON h.mes_mask & (1 << (m.mes - 1)) <> 0
+             WHERE h.anio > 0 AND %(where)s
+          GROUP BY h.anio, m.mes
+          ORDER BY h.anio, m.mes
+        """, table=SQL.identifier(_TABLE), where=SQL(' AND ').join(conditions)))
+        result = []
+        for anio, mes, count, avg_all_in, avg_ocean, min_all_in, max_all_in in self.env.cr.fetchall():
+            code = str(mes).zfill(2)
+            result.append({
+                'anio': anio,
+                'mes': code,
+                'periodo': f"{_MESES_NOMBRES.get(code, code)}/{anio}",
+                'count': count,
+                'avg_all_in': round(float(avg_all_in or 0), 2),
+                'avg_ocean': round(float(avg_ocean or 0), 2),
+                'min_all_in': float(min_all_in or 0),
+                'max_all_in': float(max_all_in or 0),
+            })
+        return result
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Instrumentación ligera de las rutas calientes del tarifario.
+
+@instrumented('nombre') mide cada llamada (tiempo, consultas SQL y registros
+recibidos) y la deja en un buffer circular EN MEMORIA del worker: sin
+escrituras en base de datos ni costo perceptible. El menú técnico
+(modo desarrollador) muestra las muestras del worker que atiende la
+petición; freight.tariff.instrumentation.get_samples() las expone por RPC.
+"""
+import functools
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from odoo import models, fields, api, _
+from odoo.exceptions import AccessError
+
+# Muestras retenidas por worker (las más antiguas se descartan).
+_RING_SIZE = 500
+_SAMPLES = deque(maxlen=_RING_SIZE)
+
+
+@contextmanager
+def measure(env, name, records=0):
+    """Mide el bloque y agrega la muestra al buffer, aun si el bloque falla.
+    Entrega la muestra: el bloque puede fijar sample['records'] cuando el
+    conteo se conoce al final."""
+    queries = env.cr.sql_log_count
+    start = time.perf_counter()
+    sample = {'method': name, 'records': records, 'uid': env.uid, 'failed': True}
+    try:
+        yield sample
+        sample['failed'] = False
+    finally:
+        sample.update(
+            at=fields.Datetime.now(),
+            seconds=time.perf_counter() - start,
+            queries=env.cr.sql_log_count - queries,
+        )
+        _SAMPLES.append(sample)
+
+
+def instrumented(name, records=None):
+    """Decorador de métodos de modelo: mide cada llamada con measure().
+
+    :param records: función ``(resultado) -> int`` con los registros tocados;
+        obligatoria en los métodos @api.model, cuyo recordset receptor está
+        vacío. Sin ella se cuentan los registros del receptor.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with measure(self.env, name, len(self)) as sample:
+                result = method(self, *args, **kwargs)
+                if records is not None:
+                    sample['records'] = records(result)
+                return result
+        return wrapper
+    return decorator
+
+
+class lazy_display_names:
+    """Nombres de un recordset formateados SOLO si la línea de log se emite
+    (logging difiere el %s hasta saber que el nivel está habilitado)."""
+    __slots__ = ('records',)
+
+    def __init__(self, records):
+        self.records = records
+
+    def __str__(self):
+        names = self.records.mapped('display_name')
+        return names[0] if len(names) == 1 else str(names)
+
+
+class FreightTariffInstrumentation(models.AbstractModel):
+    _name = 'freight.tariff.instrumentation'
+    _description = 'Instrumentación del Tarifario'
+
+    @api.model
+    def get_samples(self, method=None, limit=None):
+        """Muestras del buffer de este worker, de la más reciente a la más
+        antigua (opcionalmente de un solo método)."""
+        self.env['freight.tariff.perf.sample'].check_access('read')
+        samples = [dict(s) for s in reversed(_SAMPLES) if not method or s['method'] == method]
+        return samples[:limit] if limit else samples
+
+    @api.model
+    def get_summary(self):
+        """Resumen por método: llamadas, tiempo promedio/máximo y consultas
+        promedio."""
+        summary = {}
+        for s in self.get_samples():
+            row = summary.setdefault(s['method'], {
+                'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'queries': 0, 'records': 0,
+            })
+            row['calls'] += 1
+            row['seconds'] += s['seconds']
+            row['max_seconds'] = max(row['max_seconds'], s['seconds'])
+            row['queries'] += s['queries']
+            row['records'] += s['records']
+        for row in summary.values():
+            row['avg_seconds'] = row.pop('seconds') / row['calls']
+            row['avg_queries'] = row.pop('queries') / row['calls']
+        return summary
+
+    @api.model
+    def action_view_samples(self):
+        """Vuelca el buffer a registros transitorios para verlo en lista.
+        Solo lectura para el usuario: el volcado lo hace el sistema."""
+        self.env['freight.tariff.perf.sample'].check_access('read')
+        Sample = self.env['freight.tariff.perf.sample'].sudo()
+        Sample.search([('create_uid', '=', self.env.uid)]).unlink()
+        Sample.create([{
+            'method': s['method'],
+            'at': s['at'],
+            'seconds': s['seconds'],
+            'queries': s['queries'],
+            'records': s['records'],
+            'user_id': s['uid'],
+            'failed': s['failed'],
+        } for s in self.get_samples()])
+        return self.env['ir.actions.act_window']._for_xml_id(
+            'logistica_tarifario.action_freight_tariff_perf_sample')
+
+    @api.model
+    def action_clear_samples(self):
+        if not self.env.is_system():
+            raise AccessError(_("Solo un administrador puede vaciar las muestras."))
+        _SAMPLES.clear()
+        return True
+
+
+class FreightTariffPerfSample(models.TransientModel):
+    _name = 'freight.tariff.perf.sample'
+    _description = 'Muestra de rendimiento del Tarifario'
+    _order = 'at desc, id desc'
+
+    method = fields.Char(string='Método', readonly=True)
+    at = fields.Datetime(string='Momento', readonly=True)
+    seconds = fields.Float(string='Segundos', digits=(16, 4), readonly=True, aggregator='avg')
+    queries = fields.Integer(string='Consultas SQL', readonly=True, aggregator='avg')
+    records = fields.Integer(string='Registros', readonly=True, aggregator='avg')
+    user_id = fields.Many2one('res.users', string='Usuario', readonly=True)
+    failed = fields.Boolean(string='Falló', readonly=True)
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""Snapshot persistente de los KPIs del dashboard del tarifario.
+
+Cada fila es un BUCKET (forwarder, naviera, ruta, equipo, país o periodo
+de la tendencia) con los agregados que calcula el motor del dashboard
+(freight.tariff._get_dashboard_aggregates). Las escrituras del tarifario
+marcan los buckets que tocan y estos se refrescan UNA vez al confirmar la
+transacción; el dashboard lee todo con un SELECT.
+"""
+import logging
+from collections import defaultdict
+
+from odoo import models, fields, api
+from odoo.tools import SQL
+
+from .tarifario_master import _DASHBOARD_GROUPING_SETS, SNAPSHOT_KPIS
+
+_logger = logging.getLogger(__name__)
+
+# Con más buckets sucios que esto, recalcular el bloque completo es más
+# barato que filtrar bucket por bucket.
+_MAX_BUCKETS_PER_REFRESH = 200
+
+# Buckets sucios de la transacción en curso (cr.precommit.data).
+_PENDING_BUCKETS_KEY = 'logistica_tarifario.kpi_pending_buckets'
+
+_MEASURE_COLUMNS = (
+    'total', 'activas', 'expiradas', 'avg_all_in', 'avg_ocean', 'avg_transit',
+    'min_all_in', 'max_all_in', 'trend_avg_all_in', 'trend_avg_ocean',
+)
+
+
+class FreightTariffKpi(models.Model):
+    _name = 'freight.tariff.kpi'
+    _description = 'Snapshot de KPIs del Tarifario'
+    _log_access = False
+    _order = 'kpi, activas desc, id'
+
+    bucket = fields.Char(string='Bucket', required=True, readonly=True)
+    kpi = fields.Selection([
+        ('forwarder', 'Forwarder'),
+        ('naviera', 'Naviera'),
+        ('ruta', 'Ruta'),
+        ('equipo', 'Equipo'),
+        ('pais', 'País'),
+        ('tendencia', 'Tendencia mensual'),
+    ], string='Bloque', required=True, readonly=True)
+
+    forwarder_id = fields.Many2one('res.partner', string='Forwarder', ondelete='cascade', readonly=True)
+    naviera_id = fields.Many2one('res.partner', string='Naviera', ondelete='cascade', readonly=True)
+    pol_id = fields.Many2one('res.partner', string='POL', ondelete='cascade', readonly=True)
+    pod_id = fields.Many2one('res.partner', string='POD', ondelete='cascade', readonly=True)
+    equipo = fields.Char(string='Equipo', readonly=True)
+    country_id = fields.Many2one('res.country', string='País', ondelete='cascade', readonly=True)
+    anio = fields.Char(string='Año', readonly=True)
+    mes = fields.Char(string='Mes', readonly=True)
+
+    total = fields.Integer(string='Tarifas', readonly=True)
+    activas = fields.Integer(string='Vigentes', readonly=True)
+    expiradas = fields.Integer(string='Expiradas', readonly=True)
+    avg_all_in = fields.Float(string='All In promedio (vigentes)', readonly=True)
+    avg_ocean = fields.Float(string='Ocean promedio (vigentes)', readonly=True)
+    avg_transit = fields.Float(string='Transit time promedio (vigentes)', readonly=True)
+    min_all_in = fields.Float(string='All In mínimo (vigentes)', readonly=True)
+    max_all_in = fields.Float(string='All In máximo (vigentes)', readonly=True)
+    trend_avg_all_in = fields.Float(string='All In promedio (tendencia)', readonly=True)
+    trend_avg_ocean = fields.Float(string='Ocean promedio (tendencia)', readonly=True)
+
+    # El bucket es la llave del upsert incremental; (kpi, activas) sirve la
+    # lectura completa del dashboard ya ordenada.
+    _bucket_uniq = models.UniqueIndex('(bucket)')
+    _kpi_activas_idx = models.Index('(kpi, activas DESC)')
+
+    @api.model
+    def _bucket_key(self, kpi, values):
+        """Llave textual del bucket: 'kpi|v1|v2' (vacío = NULL)."""
+        return '|'.join([kpi] + [
+            '' if values[col] is None else str(values[col])
+            for col in _DASHBOARD_GROUPING_SETS[kpi]
+        ])
+
+    @api.model
+    def _upsert_rows(self, kpi, rows):
+        if not rows:
+            return
+        columns = ['bucket', 'kpi', *_DASHBOARD_GROUPING_SETS[kpi], *_MEASURE_COLUMNS]
+        values = SQL(', ').join(
+            SQL('(%s)', SQL(', ').join([
+                self._bucket_key(kpi, row), kpi,
+                *(row[col] for col in _DASHBOARD_GROUPING_SETS[kpi]),
+                *(row[col] for col in _MEASURE_COLUMNS),
+            ]))
+            for row in rows
+        )
+        self.env.cr.execute(SQL(
+            "INSERT INTO freight_tariff_kpi (%s) VALUES %s "
+            "ON CONFLICT (bucket) DO UPDATE SET %s",
+            SQL(', ').join(SQL.identifier(col) for col in columns),
+            values,
+            SQL(', ').join(
+                SQL('%s = EXCLUDED.%s', SQL.identifier(col), SQL.identifier(col))
+                for col in _MEASURE_COLUMNS
+            ),
+        ))
+
+    @api.model
+    def _refresh_buckets(self, keys_by_kpi):
+        """Marca como sucios los buckets indicados ({kpi: {tupla de
+        llaves}}). Se refrescan al confirmar la transacción (precommit): un
+        lote de escrituras refresca cada bucket UNA sola vez."""
+        keys_by_kpi = {kpi: keys for kpi, keys in keys_by_kpi.items() if keys}
+        if not keys_by_kpi:
+            return
+        cr = self.env.cr
+        pending = cr.precommit.data.get(_PENDING_BUCKETS_KEY)
+        if pending is None:
+            pending = cr.precommit.data[_PENDING_BUCKETS_KEY] = defaultdict(set)
+            cr.precommit.add(self.sudo()._flush_pending_buckets)
+        for kpi, keys in keys_by_kpi.items():
+            pending[kpi] |= keys
+
+    @api.model
+    def _flush_pending_buckets(self):
+        """Refresca ya los buckets sucios de la transacción (precommit, o
+        antes de leer el snapshot dentro de la misma transacción)."""
+        pending = self.env.cr.precommit.data.pop(_PENDING_BUCKETS_KEY, None)
+        if pending:
+            self._refresh_buckets_now(pending)
+
+    @api.model
+    def _bucket_condition(self, kpi, key):
+        """Condición SQL (alias ft) del bucket: igualdades indexables, con
+        IS NULL solo para las llaves vacías."""
+        return SQL('(%s)', SQL(' AND ').join(
+            SQL('%s IS NULL', SQL.identifier('ft', col)) if value is None
+            else SQL('%s = %s', SQL.identifier('ft', col), value)
+            for col, value in zip(_DASHBOARD_GROUPING_SETS[kpi], key)
+        ))
+
+    @api.model
+    def _refresh_buckets_now(self, keys_by_kpi):
+        """Recalcula los buckets indicados con UNA pasada del motor del
+        dashboard acotada a ellos, hace upsert de los que siguen teniendo
+        tarifas y borra los que quedaron vacíos. Un bloque con demasiados
+        buckets sucios se reconstruye completo."""
+        full = [kpi for kpi, keys in keys_by_kpi.items() if len(keys) > _MAX_BUCKETS_PER_REFRESH]
+        partial = {
+            kpi: keys for kpi, keys in keys_by_kpi.items()
+            if keys and kpi not in full
+        }
+        if full:
+            self._rebuild(kpis=full)
+        if not partial:
+            return
+        # El OR de los buckets trae completas las filas de cada bucket
+        # sucio; los grupos que no son sucios (filas traídas por el bucket
+        # de otro bloque) quedan parciales y se descartan.
+        where = SQL('(%s)', SQL(' OR ').join(
+            self._bucket_condition(kpi, key)
+            for kpi, keys in partial.items()
+            for key in keys
+        ))
+        aggregates = self.env['freight.tariff']._get_dashboard_aggregates(list(partial), where=where)
+        stale = []
+        for kpi, keys in partial.items():
+            columns = _DASHBOARD_GROUPING_SETS[kpi]
+            rows = [
+                row for row in aggregates[kpi]
+                if tuple(row[col] for col in columns) in keys
+            ]
+            self._upsert_rows(kpi, rows)
+            alive = {self._bucket_key(kpi, row) for row in rows}
+            stale.extend(
+                bucket for bucket in (
+                    self._bucket_key(kpi, dict(zip(columns, key))) for key in keys
+                ) if bucket not in alive
+            )
+        if stale:
+            self.env.cr.execute(SQL(
+                "DELETE FROM freight_tariff_kpi WHERE bucket IN %s", tuple(stale),
+            ))
+        self.invalidate_model()
+
+    @api.model
+    def _rebuild(self, kpis=SNAPSHOT_KPIS):
+        """Reconstrucción COMPLETA del snapshot (o de los bloques indicados)."""
+        kpis = list(kpis)
+        self.env.cr.execute(SQL(
+            "DELETE FROM freight_tariff_kpi WHERE kpi IN %s", tuple(kpis),
+        ))
+        aggregates = self.env['freight.tariff']._get_dashboard_aggregates(kpis)
+        for kpi in kpis:
+            self._upsert_rows(kpi, aggregates[kpi])
+        self.invalidate_model()
+        _logger.info(
+            "[TARIFARIO_KPI] Snapshot reconstruido (%s): %s buckets.",
+            ', '.join(kpis), sum(len(aggregates[kpi]) for kpi in kpis),
+        )
+        return True
+
+    @api.model
+    def _read_snapshot(self):
+        """Lectura del dashboard: UN select indexado → {kpi: [filas]} con
+        la misma forma que las filas del motor de agregación. Se lee con los
+        permisos del usuario; solo el mantenimiento del snapshot (buckets
+        sucios, o construirlo si aún no existe) corre como superusuario."""
+        self.check_access('read')
+        self.sudo()._flush_pending_buckets()
+        if not self.search_count([], limit=1) and self.env['freight.tariff'].sudo().search_count([], limit=1):
+            # Snapshot aún sin construir (instalación/actualización).
+            self.sudo()._rebuild()
+        self.env.cr.execute("""
+            SELECT kpi, forwarder_id, naviera_id, pol_id, pod_id, equipo,
+                   country_id, anio, mes, total, activas, expiradas,
+                   avg_all_in, avg_ocean, avg_transit, min_all_in, max_all_in,
+                   trend_avg_all_in, trend_avg_ocean
+              FROM freight_tariff_kpi
+          ORDER BY kpi, activas DESC
+        """)
+        result = {kpi: [] for kpi in SNAPSHOT_KPIS}
+        for row in self.env.cr.dictfetchall():
+            result[row.pop('kpi')].append(row)
+        return result
@@ -1,6 +1,102 @@
+import calendar
+import logging
+
 from odoo import models, fields, api
-from datetime import date, timedelta
-from collections import defaultdict
+from odoo.tools import SQL
+from odoo.tools.lru import LRU
+from datetime import date
+from collections import defaultdict, namedtuple
+
+from .tarifario_instrumentation import instrumented, measure
+
+_logger = logging.getLogger(__name__)
+
+# Motor de KPIs del dashboard: columnas agrupables y el GROUPING SET que
+# alimenta cada bloque (todo sale de UNA pasada sobre freight_tariff).
+_DASHBOARD_GROUP_COLUMNS = (
+    'forwarder_id', 'naviera_id', 'pol_id', 'pod_id',
+    'equipo', 'country_id', 'anio', 'mes',
+)
+_DASHBOARD_GROUPING_SETS = {
+    'global': (),
+    'forwarder': ('forwarder_id',),
+    'naviera': ('naviera_id',),
+    'ruta': ('pol_id', 'pod_id'),
+    'equipo': ('equipo',),
+    'pais': ('country_id',),
+    'tendencia': ('anio', 'mes'),
+}
+
+# Campos de partner del tarifario y la etiqueta que garantizan al partner.
+_PARTNER_TAG_FIELDS = {
+    'forwarder_id': 'Forwarder',
+    'naviera_id': 'Naviera',
+    'pol_id': 'POL',
+    'pod_id': 'POD',
+}
+
+# Componentes del ALL-IN (cada uno suma a all_in).
+_COST_FIELDS = (
+    'costo_exw', 'ocean_freight', 'ams_imo', 'lib_seguro', 'maniobras',
+    'vacio_lavado', 'aa', 'flete_terrestre', 'profepa', 'uva', 'fee',
+)
+
+# Escrituras que mueven algún bucket del snapshot de KPIs.
+_KPI_TRIGGER_FIELDS = frozenset(
+    _DASHBOARD_GROUP_COLUMNS + _COST_FIELDS
+    + ('active', 'state', 'mes_ids', 'transit_time', 'all_in')
+)
+
+# Escrituras que cambian el catálogo vigente cacheado por worker: llaves de
+# la ruta, vigencia/estado y ALL-IN (el catálogo lo guarda; los costos lo
+# recalculan). Suben la versión del catálogo (ver _catalog_changed).
+_TARIFF_CACHE_FIELDS = frozenset(
+    ('country_id', 'forwarder_id', 'naviera_id', 'pol_id', 'pod_id', 'equipo',
+     'active', 'state', 'anio', 'mes_ids', 'valid_from', 'valid_to', 'all_in') + _COST_FIELDS
+)
+
+# Escrituras que pueden cambiar state (directo o vía valid_to): se
+# compara el estado antes/después para registrar las expiraciones.
+_STATE_TRIGGER_FIELDS = frozenset(('state', 'anio', 'mes_ids', 'valid_from', 'valid_to'))
+
+# Fila compacta del catálogo vigente (tuplas: poca memoria por tarifa).
+ActiveTariff = namedtuple('ActiveTariff', [
+    'id', 'country_id', 'forwarder_id', 'naviera_id', 'pol_id', 'pod_id',
+    'equipo', 'all_in',
+])
+
+# Caché del catálogo vigente por worker: {dbname: _CatalogSlot}. Guarda UNA
+# versión por base (la anterior se descarta al cambiar de versión) y, dentro
+# de ella, un LRU acotado con el catálogo y sus derivados (índice de la
+# cascada, tarifas por ruta, carriles más económicos).
+_CATALOG_DERIVED_SIZE = 4096
+_CATALOG_SLOTS = {}
+_CatalogSlot = namedtuple('_CatalogSlot', ['version', 'derived'])
+
+# Llaves de cr.precommit.data (estado de la transacción en curso).
+_CATALOG_VERSION_KEY = 'logistica_tarifario.catalog_version'
+_CATALOG_DIRTY_KEY = 'logistica_tarifario.catalog_dirty'
+
+# Bloques del dashboard persistidos en freight.tariff.kpi (el resumen global
+# y las alertas dependen de la fecha del día y se calculan en vivo).
+SNAPSHOT_KPIS = ('forwarder', 'naviera', 'ruta', 'equipo', 'pais', 'tendencia')
+
+
+def _anio_int_sql(anio):
+    """Expresión SQL del año capturado (Char) como entero; NULL si no es un
+    año de 1 a 4 dígitos (la regla de _compute_validity_range). Es la ÚNICA
+    interpretación del año en SQL: vigencia, histórico y archivo."""
+    return SQL(
+        "CASE WHEN TRIM(%(anio)s) ~ '^[0-9]{1,4}$' THEN TRIM(%(anio)s)::int END",
+        anio=anio,
+    )
+
+
+_MESES_NOMBRES = {
+    '01': 'Ene', '02': 'Feb', '03': 'Mar', '04': 'Abr',
+    '05': 'May', '06': 'Jun', '07': 'Jul', '08': 'Ago',
+    '09': 'Sep', '10': 'Oct', '11': 'Nov', '12': 'Dic'
+}
 
 
 class FreightTariffMonth(models.Model):
@@ -78,6 +174,19 @@ class FreightTariff(models.Model):
         ('09', 'Septiembre'), ('10', 'Octubre'), ('11', 'Noviembre'), ('12', 'Diciembre')
     ], string='Mes Principal', compute='_compute_mes_legacy', store=True)
 
+    # Expansión indexada (tarifa, año, mes) de la vigencia: tendencia,
+    # expiración y "vigente en el mes X" consultan aquí (freight.tariff.validity).
+    validity_ids = fields.One2many(
+        'freight.tariff.validity', 'tariff_id', string='Vigencia mensual', readonly=True,
+    )
+
+    # Vigencia como rango de FECHAS (primer día del primer mes → último día
+    # del último mes). anio/mes_ids siguen siendo la captura; estas fechas se
+    # derivan de ellas y alimentan el índice GiST de búsqueda por fecha
+    # (ver init y get_tariffs_valid_on). Vacías = sin vigencia definida.
+    valid_from = fields.Date(string='Vigente desde', compute='_compute_validity_range', store=True)
+    valid_to = fields.Date(string='Vigente hasta', compute='_compute_validity_range', store=True)
+
     # ==========================
     # COSTOS (ACTUALIZADO)
     # ==========================
@@ -177,6 +286,38 @@ class FreightTariff(models.Model):
         help='Porcentaje de costos adicionales sobre Ocean Freight'
     )
 
+    # ==========================
+    # ÍNDICES
+    # ==========================
+    # Tarifa más económica por carril: índice parcial (solo vigentes) cuyo
+    # orden (pol, pod, equipo, all_in) sirve el ORDER BY all_in LIMIT N sin
+    # sort, e INCLUDE(id) lo vuelve index-only.
+    _cheapest_lane_idx = models.Index(
+        "(pol_id, pod_id, equipo, all_in) INCLUDE (id) "
+        "WHERE state = 'active' AND active = true"
+    )
+    # Refresco incremental del snapshot de KPIs: cada bucket sucio es una
+    # igualdad sobre sus columnas (ver freight.tariff.kpi._refresh_buckets);
+    # la tendencia usa el índice (anio, mes) de freight.tariff.validity.
+    _kpi_forwarder_idx = models.Index('(forwarder_id)')
+    _kpi_naviera_idx = models.Index('(naviera_id)')
+    _kpi_route_idx = models.Index('(pol_id, pod_id)')
+    _kpi_equipo_idx = models.Index('(equipo)')
+    _kpi_country_idx = models.Index('(country_id)')
+
+    def init(self):
+        # "¿Qué tarifas están vigentes en la fecha X?" → contención de rango
+        # servida por GiST (solo tarifas no archivadas).
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS freight_tariff_valid_range_gist
+                ON freight_tariff USING gist (daterange(valid_from, valid_to, '[]'))
+             WHERE active = true
+        """)
+        # Versión del catálogo vigente: llave de la caché por worker. Es una
+        # secuencia (no transaccional, sin bloqueos de fila): la sube, ya
+        # confirmada, cada transacción que modifica el catálogo.
+        self.env.cr.execute("CREATE SEQUENCE IF NOT EXISTS freight_tariff_catalog_version_seq")
+
     # ==========================
     # MÉTODOS COMPUTE
     # ==========================
@@ -242,225 +383,412 @@ class FreightTariff(models.Model):
             rec.name = ' | '.join(filter(None, parts))
 
     @api.depends('anio', 'mes_ids')
-    def _compute_state(self):
-        today = date.today()
-        current_year = today.year
-        current_month_code = str(today.month).zfill(2)
-        
+    def _compute_validity_range(self):
         for rec in self:
-            if not rec.anio or not rec.mes_ids:
-                rec.state = 'active'
-                continue
-            
+            months = sorted(
+                int(code) for code in rec.mes_ids.mapped('code')
+                if code and code.isdigit() and 1 <= int(code) <= 12
+            )
             try:
-                tariff_year = int(rec.anio)
-                if tariff_year < current_year:
-                    # Año pasado -> Expirado
-                    rec.state = 'expired'
-                elif tariff_year > current_year:
-                    # Año futuro -> Vigente
-                    rec.state = 'active'
-                else:
-                    # Año actual: Verificar si ALGUNO de los meses seleccionados
-                    # es igual o posterior al mes actual.
-                    codes = rec.mes_ids.mapped('code') # ej: ['01', '03']
-                    is_active = False
-                    for code in codes:
-                        if code >= current_month_code:
-                            is_active = True
-                            break
-                    
-                    rec.state = 'active' if is_active else 'expired'
-            except ValueError:
-                rec.state = 'active'
+                year = int((rec.anio or '').strip())
+                rec.valid_from = date(year, months[0], 1)
+                rec.valid_to = date(year, months[-1], calendar.monthrange(year, months[-1])[1])
+            except (ValueError, IndexError):
+                # Año no numérico / fuera de rango o sin meses.
+                rec.valid_from = False
+                rec.valid_to = False
+
+    @api.depends('valid_to')
+    def _compute_state(self):
+        # Vigente mientras algún mes de vigencia sea el actual o posterior,
+        # es decir, mientras valid_to no sea anterior al inicio del mes. Sin
+        # vigencia definida (año no numérico o sin meses) cuenta como vigente.
+        month_start = date.today().replace(day=1)
+        for rec in self:
+            rec.state = 'expired' if rec.valid_to and rec.valid_to < month_start else 'active'
+
+    @api.model
+    def _cron_expire_tariffs(self):
+        """Cron de cambio de mes: recalcula state de TODO el tarifario con un
+        solo UPDATE set-based (misma regla que _compute_state, sobre valid_to)
+        y solo toca las filas cuyo estado cambia.
+
+        _compute_state depende de la fecha del día pero solo se dispara al
+        editar anio/mes_ids: sin este cron las tarifas nunca expiran solas."""
+        today = date.today()
+        self.flush_model(['valid_to', 'state'])
+        self.env.cr.execute(SQL("""
+            UPDATE freight_tariff ft
+               SET state = computed.new_state
+              FROM (
+                  SELECT id,
+                         CASE WHEN valid_to < %(month_start)s THEN 'expired' ELSE 'active' END AS new_state
+                    FROM freight_tariff
+              ) computed
+             WHERE computed.id = ft.id
+               AND ft.state IS DISTINCT FROM computed.new_state
+         RETURNING ft.id
+        """, month_start=today.replace(day=1)))
+        changed = self.browse(row[0] for row in self.env.cr.fetchall())
+        _logger.info(
+            "[TARIFARIO] Vigencia recalculada al %s: %s tarifa(s) cambiaron de estado.",
+            today, len(changed),
+        )
+        if changed:
+            self.invalidate_model(['state'])
+            self.env['freight.tariff.kpi']._refresh_buckets(changed._kpi_bucket_keys())
+            self.env['freight.tariff.history']._record(
+                changed.filtered(lambda t: t.state == 'expired'), 'expired')
+            self._catalog_changed()
+        return len(changed)
 
     # =====================================================
     # MÉTODOS PARA DASHBOARD KPIs
     # =====================================================
 
     @api.model
+    @instrumented('freight.tariff.get_dashboard_data',
+                  records=lambda result: result['resumen']['total'])
     def get_dashboard_data(self):
-        """Endpoint principal para obtener todos los KPIs del dashboard"""
+        """Endpoint principal para obtener todos los KPIs del dashboard.
+
+        Los top, estadísticas y tendencia se leen del snapshot persistente
+        (freight.tariff.kpi, un select indexado); el resumen global y las
+        alertas salen de una pasada en vivo del motor de agregación. Cada
+        _get_* solo da forma a sus filas.
+
+        Se lee con los permisos del usuario. El snapshot es global: si al
+        usuario le aplican reglas de registro sobre las tarifas, todo se
+        agrega en vivo sobre las que puede ver."""
+        self.check_access('read')
+        rules = self._read_rules_sql()
+        if rules is None:
+            aggregates = self.env['freight.tariff.kpi']._read_snapshot()
+            aggregates.update(self._get_dashboard_aggregates(['global']))
+        else:
+            aggregates = self._get_dashboard_aggregates(where=rules)
+        self._dashboard_prefetch_names(aggregates)
         return {
-            'resumen': self._get_resumen_general(),
+            'resumen': self._get_resumen_general(aggregates=aggregates),
             'promedios': self._get_promedios_activos(),
-            'top_forwarders': self._get_top_forwarders(limit=5),
-            'top_navieras': self._get_top_navieras(limit=5),
-            'top_rutas': self._get_top_rutas(limit=5),
-            'por_equipo': self._get_stats_por_equipo(),
-            'por_pais': self._get_stats_por_pais(limit=5),
-            'tendencia': self._get_tendencia_mensual(meses=12),
-            'variaciones': self._get_variaciones_mensuales(),
-            'alertas': self._get_alertas(),
-            'comparativo_equipos': self._get_comparativo_equipos(),
+            'top_forwarders': self._get_top_forwarders(limit=5, aggregates=aggregates),
+            'top_navieras': self._get_top_navieras(limit=5, aggregates=aggregates),
+            'top_rutas': self._get_top_rutas(limit=5, aggregates=aggregates),
+            'por_equipo': self._get_stats_por_equipo(aggregates=aggregates),
+            'por_pais': self._get_stats_por_pais(limit=5, aggregates=aggregates),
+            'tendencia': self._get_tendencia_mensual(meses=12, aggregates=aggregates),
+            'variaciones': self._get_variaciones_mensuales(aggregates=aggregates),
+            'alertas': self._get_alertas(aggregates=aggregates),
+            'comparativo_equipos': self._get_comparativo_equipos(aggregates=aggregates),
+        }
+
+    @api.model
+    @instrumented('freight.tariff._get_dashboard_aggregates',
+                  records=lambda result: sum(len(rows) for rows in result.values()))
+    def _get_dashboard_aggregates(self, kpis=None, where=None):
+        """Motor de agregación del dashboard: UNA sentencia con GROUPING SETS
+        sobre freight_tariff (active = true) calcula a la vez el resumen, los
+        top y las estadísticas por equipo/país.
+
+        Las métricas 'vigentes' usan FILTER (state = 'active'); la tendencia
+        conserva su regla histórica (todas las tarifas no archivadas) pero
+        cuenta cada mes de vigencia: sus GROUPING SETS corren sobre la
+        expansión freight.tariff.validity (mismas columnas, con anio/mes de
+        la fila de vigencia) y van en la misma sentencia con UNION ALL.
+
+        :param kpis: llaves de _DASHBOARD_GROUPING_SETS a calcular (default: todas)
+        :param where: SQL adicional (alias ft) para acotar el barrido
+        :return: {kpi: [filas crudas del conjunto]}
+        """
+        kpis = list(kpis or _DASHBOARD_GROUPING_SETS)
+        self.flush_model()
+        branches = []
+        if 'tendencia' in kpis:
+            self.env['freight.tariff.validity'].flush_model()
+            branches.append((['tendencia'], SQL("""(
+                SELECT t.id, t.active, t.state, t.forwarder_id, t.naviera_id,
+                       t.pol_id, t.pod_id, t.equipo, t.country_id, v.anio, v.mes,
+                       t.all_in, t.ocean_freight, t.transit_time
+                  FROM freight_tariff_validity v
+                  JOIN freight_tariff t ON t.id = v.tariff_id
+            )""")))
+        other = [kpi for kpi in kpis if kpi != 'tendencia']
+        if other:
+            branches.append((other, SQL.identifier('freight_tariff')))
+        queries = []
+        kpi_by_branch_mask = {}
+        for branch, (branch_kpis, source) in enumerate(branches):
+            query, kpi_by_mask = self._dashboard_aggregate_query(branch, branch_kpis, source, where)
+            queries.append(query)
+            kpi_by_branch_mask.update({
+                (branch, mask): kpi for mask, kpi in kpi_by_mask.items()
+            })
+        self.env.cr.execute(SQL(' UNION ALL ').join(queries))
+        result = {kpi: [] for kpi in kpis}
+        for row in self.env.cr.dictfetchall():
+            key = (row.pop('grouping_branch'), row.pop('grouping_mask'))
+            result[kpi_by_branch_mask[key]].append(row)
+        return result
+
+    @api.model
+    def _dashboard_aggregate_query(self, branch, kpis, source, where=None):
+        """SELECT con los GROUPING SETS de ``kpis`` sobre ``source`` (alias
+        ft). Todas las ramas exponen las mismas columnas (NULL donde la rama
+        no agrupa) para unirse con UNION ALL; cada fila se identifica por
+        (rama, máscara GROUPING).
+
+        :return: (SQL, {máscara: kpi})
+        """
+        columns = [
+            col for col in _DASHBOARD_GROUP_COLUMNS
+            if any(col in _DASHBOARD_GROUPING_SETS[kpi] for kpi in kpis)
+        ]
+        # GROUPING(c1..cn) prende el bit de cada columna NO agrupada en la
+        # fila (c1 es el bit más alto): identifica el conjunto de cada fila.
+        kpi_by_mask = {
+            sum(
+                1 << (len(columns) - 1 - i)
+                for i, col in enumerate(columns)
+                if col not in _DASHBOARD_GROUPING_SETS[kpi]
+            ): kpi
+            for kpi in kpis
+        }
+        mask = SQL('GROUPING(%s)', SQL(', ').join(
+            SQL.identifier('ft', col) for col in columns
+        )) if columns else SQL('0')
+        grouping_sets = SQL(', ').join(
+            SQL('(%s)', SQL(', ').join(
+                SQL.identifier('ft', col) for col in _DASHBOARD_GROUPING_SETS[kpi]
+            ))
+            for kpi in kpis
+        )
+        today = date.today()
+        query = SQL("""
+            SELECT
+                %(keys)s,
+                COUNT(*) AS total,
+                COUNT(*) FILTER (WHERE ft.state = 'active') AS activas,
+                COUNT(*) FILTER (WHERE ft.state = 'expired') AS expiradas,
+                COUNT(*) FILTER (WHERE ft.state = 'active' AND ft.naviera_id IS NOT NULL) AS con_naviera,
+                COUNT(*) FILTER (WHERE ft.state = 'active' AND ft.naviera_id IS NULL) AS sin_naviera,
+                COUNT(*) FILTER (
+                    WHERE ft.state = 'active' AND ft.id IN (
+                        -- Vigentes este mes y en ningún mes posterior.
+                        SELECT v.tariff_id FROM freight_tariff_validity v
+                         WHERE v.period = %(period)s
+                           AND NOT EXISTS (
+                               SELECT 1 FROM freight_tariff_validity nxt
+                                WHERE nxt.tariff_id = v.tariff_id AND nxt.period > %(period)s
+                           )
+                    )
+                ) AS expiran_este_mes,
+                COUNT(DISTINCT ft.forwarder_id) FILTER (WHERE ft.state = 'active') AS forwarders_activos,
+                AVG(ft.all_in) FILTER (WHERE ft.state = 'active') AS avg_all_in,
+                AVG(ft.ocean_freight) FILTER (WHERE ft.state = 'active') AS avg_ocean,
+                AVG(ft.transit_time) FILTER (WHERE ft.state = 'active') AS avg_transit,
+                MIN(ft.all_in) FILTER (WHERE ft.state = 'active') AS min_all_in,
+                MAX(ft.all_in) FILTER (WHERE ft.state = 'active') AS max_all_in,
+                AVG(ft.all_in) AS trend_avg_all_in,
+                AVG(ft.ocean_freight) AS trend_avg_ocean
+            FROM %(source)s ft
+            WHERE ft.active = true AND %(where)s
+            GROUP BY GROUPING SETS (%(sets)s)
+        """,
+            keys=SQL(', ').join([
+                SQL('%s AS grouping_branch', branch),
+                SQL('%s AS grouping_mask', mask),
+                *(
+                    SQL('%s AS %s',
+                        SQL.identifier('ft', col) if col in columns else SQL('NULL'),
+                        SQL.identifier(col))
+                    for col in _DASHBOARD_GROUP_COLUMNS
+                ),
+            ]),
+            period=today.year * 100 + today.month,
+            source=source,
+            where=where or SQL('TRUE'),
+            sets=grouping_sets,
+        )
+        return query, kpi_by_mask
+
+    @api.model
+    def _dashboard_prefetch_names(self, aggregates):
+        """Precarga en UNA lectura los nombres de todos los partners y países
+        que aparecen en los bloques (en vez de una lectura por bloque)."""
+        partner_ids = {
+            row[col]
+            for kpi, cols in (('forwarder', ('forwarder_id',)),
+                              ('naviera', ('naviera_id',)),
+                              ('ruta', ('pol_id', 'pod_id')))
+            for row in aggregates.get(kpi, [])
+            for col in cols
+            if row[col]
         }
+        country_ids = {row['country_id'] for row in aggregates.get('pais', []) if row['country_id']}
+        self.env['res.partner'].browse(partner_ids).mapped('display_name')
+        self.env['res.country'].browse(country_ids).mapped('display_name')
 
     @api.model
-    def _get_resumen_general(self):
+    def _dashboard_top_rows(self, rows, limit=None):
+        """Filas con tarifas vigentes, de mayor a menor número de tarifas."""
+        rows = sorted((r for r in rows if r['activas']), key=lambda r: -r['activas'])
+        return rows[:limit] if limit else rows
+
+    @api.model
+    def _get_resumen_general(self, aggregates=None):
+        aggregates = aggregates or self._get_dashboard_aggregates(['global'])
+        row = aggregates['global'][0]
         return {
-            'total': self.search_count([]),
-            'activas': self.search_count([('state', '=', 'active')]),
-            'expiradas': self.search_count([('state', '=', 'expired')]),
-            'con_naviera': self.search_count([('naviera_id', '!=', False), ('state', '=', 'active')]),
-            'sin_naviera': self.search_count([('naviera_id', '=', False), ('state', '=', 'active')]),
+            'total': row['total'],
+            'activas': row['activas'],
+            'expiradas': row['expiradas'],
+            'con_naviera': row['con_naviera'],
+            'sin_naviera': row['sin_naviera'],
         }
 
     @api.model
     def _get_promedios_activos(self):
-        tarifas = self.search([('state', '=', 'active')])
-        if not tarifas:
+        """Promedios de las tarifas vigentes, reducidos en PostgreSQL (una
+        fila, memoria constante). Los vacíos cuentan como 0, igual que el
+        cálculo original en Python (sum(t.x or 0) / count).
+
+        Instrumentado con measure() en el cuerpo: el conteo de tarifas sale
+        de la consulta y el resultado conserva su forma."""
+        with measure(self.env, 'freight.tariff._get_promedios_activos') as sample:
+            self.flush_model()
+            self.env.cr.execute("""
+                SELECT
+                    COUNT(*) AS count,
+                    AVG(COALESCE(all_in, 0)) AS all_in,
+                    AVG(COALESCE(ocean_freight, 0)) AS ocean_freight,
+                    AVG(COALESCE(ams_imo, 0)) AS ams_imo,
+                    AVG(COALESCE(lib_seguro, 0)) AS lib_seguro,
+                    AVG(COALESCE(costo_exw, 0)) AS costo_exw,
+                    AVG(COALESCE(transit_time, 0)) AS transit_time,
+                    AVG(COALESCE(demoras, 0)) AS demoras,
+                    AVG(COALESCE(margen_estimado, 0)) AS margen_pct
+                FROM freight_tariff
+                WHERE state = 'active' AND active = true
+            """)
+            r = self.env.cr.dictfetchone()
+            sample['records'] = r['count']
+        if not r['count']:
             return {
                 'all_in': 0, 'ocean_freight': 0, 'ams_imo': 0,
                 'lib_seguro': 0, 'costo_exw': 0, 'transit_time': 0,
                 'demoras': 0, 'costo_total': 0, 'margen_pct': 0
             }
-        
-        count = len(tarifas)
+
         return {
-            'all_in': round(sum(t.all_in for t in tarifas) / count, 2),
-            'ocean_freight': round(sum(t.ocean_freight or 0 for t in tarifas) / count, 2),
-            'ams_imo': round(sum(t.ams_imo or 0 for t in tarifas) / count, 2),
-            'lib_seguro': round(sum(t.lib_seguro or 0 for t in tarifas) / count, 2),
-            'costo_exw': round(sum(t.costo_exw or 0 for t in tarifas) / count, 2),
-            'transit_time': round(sum(t.transit_time or 0 for t in tarifas) / count, 1),
-            'demoras': round(sum(t.demoras or 0 for t in tarifas) / count, 1),
-            'costo_total': round(sum(t.all_in for t in tarifas) / count, 2),
-            'margen_pct': round(sum(t.margen_estimado for t in tarifas) / count, 2),
+            'all_in': round(float(r['all_in']), 2),
+            'ocean_freight': round(float(r['ocean_freight']), 2),
+            'ams_imo': round(float(r['ams_imo']), 2),
+            'lib_seguro': round(float(r['lib_seguro']), 2),
+            'costo_exw': round(float(r['costo_exw']), 2),
+            'transit_time': round(float(r['transit_time']), 1),
+            'demoras': round(float(r['demoras']), 1),
+            'costo_total': round(float(r['all_in']), 2),
+            'margen_pct': round(float(r['margen_pct']), 2),
         }
 
     @api.model
-    def _get_top_forwarders(self, limit=5):
-        data = self.read_group(
-            [('state', '=', 'active')],
-            ['forwarder_id', 'all_in:avg', 'ocean_freight:avg', 'transit_time:avg'],
-            ['forwarder_id'],
-            orderby='forwarder_id_count desc',
-            limit=limit
-        )
-        return [{
-            'id': d['forwarder_id'][0] if d['forwarder_id'] else False,
-            'name': d['forwarder_id'][1] if d['forwarder_id'] else 'Sin asignar',
-            'count': d.get('forwarder_id_count', 0),
-            'avg_all_in': round(d.get('all_in', 0) or 0, 2),
-            'avg_ocean': round(d.get('ocean_freight', 0) or 0, 2),
-            'avg_transit': round(d.get('transit_time', 0) or 0, 1),
-        } for d in data]
-
-    @api.model
-    def _get_top_navieras(self, limit=5):
-        data = self.read_group(
-            [('state', '=', 'active'), ('naviera_id', '!=', False)],
-            ['naviera_id', 'all_in:avg', 'ocean_freight:avg'],
-            ['naviera_id'],
-            orderby='naviera_id_count desc',
-            limit=limit
-        )
+    def _get_top_forwarders(self, limit=5, aggregates=None):
+        aggregates = aggregates or self._get_dashboard_aggregates(['forwarder'])
+        Partner = self.env['res.partner']
         return [{
-            'id': d['naviera_id'][0] if d['naviera_id'] else False,
-            'name': d['naviera_id'][1] if d['naviera_id'] else 'Sin asignar',
-            'count': d.get('naviera_id_count', 0),
-            'avg_all_in': round(d.get('all_in', 0) or 0, 2),
-            'avg_ocean': round(d.get('ocean_freight', 0) or 0, 2),
-        } for d in data]
+            'id': r['forwarder_id'] or False,
+            'name': Partner.browse(r['forwarder_id']).display_name if r['forwarder_id'] else 'Sin asignar',
+            'count': r['activas'],
+            'avg_all_in': round(float(r['avg_all_in'] or 0), 2),
+            'avg_ocean': round(float(r['avg_ocean'] or 0), 2),
+            'avg_transit': round(float(r['avg_transit'] or 0), 1),
+        } for r in self._dashboard_top_rows(aggregates['forwarder'], limit)]
 
     @api.model
-    def _get_top_rutas(self, limit=5):
-        self.env.cr.execute("""
-            SELECT 
-                ft.pol_id, pol.name as pol_name, ft.pod_id, pod.name as pod_name,
-                COUNT(*) as count, AVG(ft.all_in) as avg_all_in, AVG(ft.transit_time) as avg_transit
-            FROM freight_tariff ft
-            LEFT JOIN res_partner pol ON ft.pol_id = pol.id
-            LEFT JOIN res_partner pod ON ft.pod_id = pod.id
-            WHERE ft.state = 'active' AND ft.active = true
-            GROUP BY ft.pol_id, pol.name, ft.pod_id, pod.name
-            ORDER BY count DESC
-            LIMIT %s
-        """, (limit,))
-        results = self.env.cr.dictfetchall()
+    def _get_top_navieras(self, limit=5, aggregates=None):
+        aggregates = aggregates or self._get_dashboard_aggregates(['naviera'])
+        Partner = self.env['res.partner']
+        rows = [r for r in aggregates['naviera'] if r['naviera_id']]
         return [{
-            'pol_id': r['pol_id'],
-            'pol_name': r['pol_name'] or '?',
-            'pod_id': r['pod_id'],
-            'pod_name': r['pod_name'] or '?',
-            'ruta': f"{r['pol_name'] or '?'} → {r['pod_name'] or '?'}",
-            'count': r['count'],
-            'avg_all_in': round(r['avg_all_in'] or 0, 2),
-            'avg_transit': round(r['avg_transit'] or 0, 1),
-        } for r in results]
-
-    @api.model
-    def _get_stats_por_equipo(self):
-        data = self.read_group(
-            [('state', '=', 'active')],
-            ['equipo', 'all_in:avg', 'ocean_freight:avg'],
-            ['equipo'],
-            orderby='equipo_count desc'
-        )
+            'id': r['naviera_id'],
+            'name': Partner.browse(r['naviera_id']).display_name,
+            'count': r['activas'],
+            'avg_all_in': round(float(r['avg_all_in'] or 0), 2),
+            'avg_ocean': round(float(r['avg_ocean'] or 0), 2),
+        } for r in self._dashboard_top_rows(rows, limit)]
+
+    @api.model
+    def _get_top_rutas(self, limit=5, aggregates=None):
+        aggregates = aggregates or self._get_dashboard_aggregates(['ruta'])
+        Partner = self.env['res.partner']
+        result = []
+        for r in self._dashboard_top_rows(aggregates['ruta'], limit):
+            pol_name = Partner.browse(r['pol_id']).name if r['pol_id'] else False
+            pod_name = Partner.browse(r['pod_id']).name if r['pod_id'] else False
+            result.append({
+                'pol_id': r['pol_id'],
+                'pol_name': pol_name or '?',
+                'pod_id': r['pod_id'],
+                'pod_name': pod_name or '?',
+                'ruta': f"{pol_name or '?'} → {pod_name or '?'}",
+                'count': r['activas'],
+                'avg_all_in': round(float(r['avg_all_in'] or 0), 2),
+                'avg_transit': round(float(r['avg_transit'] or 0), 1),
+            })
+        return result
+
+    @api.model
+    def _get_stats_por_equipo(self, aggregates=None):
+        aggregates = aggregates or self._get_dashboard_aggregates(['equipo'])
         equipo_labels = dict(self._fields['equipo'].selection)
         return [{
-            'equipo': d['equipo'],
-            'equipo_label': equipo_labels.get(d['equipo'], d['equipo']),
-            'count': d.get('equipo_count', 0),
-            'avg_all_in': round(d.get('all_in', 0) or 0, 2),
-            'avg_ocean': round(d.get('ocean_freight', 0) or 0, 2),
-        } for d in data]
-
-    @api.model
-    def _get_stats_por_pais(self, limit=10):
-        data = self.read_group(
-            [('state', '=', 'active')],
-            ['country_id', 'all_in:avg', 'ocean_freight:avg', 'transit_time:avg'],
-            ['country_id'],
-            orderby='country_id_count desc',
-            limit=limit
-        )
+            'equipo': r['equipo'] or False,
+            'equipo_label': equipo_labels.get(r['equipo'], r['equipo'] or False),
+            'count': r['activas'],
+            'avg_all_in': round(float(r['avg_all_in'] or 0), 2),
+            'avg_ocean': round(float(r['avg_ocean'] or 0), 2),
+        } for r in self._dashboard_top_rows(aggregates['equipo'])]
+
+    @api.model
+    def _get_stats_por_pais(self, limit=10, aggregates=None):
+        aggregates = aggregates or self._get_dashboard_aggregates(['pais'])
+        Country = self.env['res.country']
         return [{
-            'country_id': d['country_id'][0] if d['country_id'] else False,
-            'country_name': d['country_id'][1] if d['country_id'] else 'Sin país',
-            'count': d.get('country_id_count', 0),
-            'avg_all_in': round(d.get('all_in', 0) or 0, 2),
-            'avg_ocean': round(d.get('ocean_freight', 0) or 0, 2),
-            'avg_transit': round(d.get('transit_time', 0) or 0, 1),
-        } for d in data]
-
-    @api.model
-    def _get_tendencia_mensual(self, meses=12):
-        """Tendencia mensual corregida para Odoo 19 usando SQL directo"""
-        # IMPORTANTE: Usa el campo computado 'mes' para agrupar
-        self.env.cr.execute("""
-            SELECT 
-                anio, mes, 
-                COUNT(*) as count, 
-                AVG(all_in) as avg_all_in, 
-                AVG(ocean_freight) as avg_ocean
-            FROM freight_tariff
-            WHERE active = true
-            GROUP BY anio, mes
-            ORDER BY anio DESC, mes DESC
-            LIMIT %s
-        """, (meses,))
-        results = self.env.cr.dictfetchall()
-        
-        meses_nombres = {
-            '01': 'Ene', '02': 'Feb', '03': 'Mar', '04': 'Abr',
-            '05': 'May', '06': 'Jun', '07': 'Jul', '08': 'Ago',
-            '09': 'Sep', '10': 'Oct', '11': 'Nov', '12': 'Dic'
-        }
-        
+            'country_id': r['country_id'] or False,
+            'country_name': Country.browse(r['country_id']).display_name if r['country_id'] else 'Sin país',
+            'count': r['activas'],
+            'avg_all_in': round(float(r['avg_all_in'] or 0), 2),
+            'avg_ocean': round(float(r['avg_ocean'] or 0), 2),
+            'avg_transit': round(float(r['avg_transit'] or 0), 1),
+        } for r in self._dashboard_top_rows(aggregates['pais'], limit)]
+
+    @api.model
+    def _get_tendencia_mensual(self, meses=12, aggregates=None):
+        """Tendencia mensual: los N periodos (anio, mes) más recientes.
+
+        IMPORTANTE: una tarifa cuenta en CADA mes de su vigencia (expansión
+        freight.tariff.validity), vigente o expirada, siempre que no esté
+        archivada. El orden replica el ORDER BY anio DESC, mes DESC de
+        PostgreSQL (NULLs primero)."""
+        aggregates = aggregates or self._get_dashboard_aggregates(['tendencia'])
+        rows = sorted(
+            aggregates['tendencia'],
+            key=lambda r: (r['anio'] is None, r['anio'] or '', r['mes'] is None, r['mes'] or ''),
+            reverse=True,
+        )[:meses]
         result = [{
             'anio': r['anio'],
             'mes': r['mes'],
-            'periodo': f"{meses_nombres.get(r['mes'], r['mes'])}/{r['anio']}",
-            'count': r['count'],
-            'avg_all_in': round(r['avg_all_in'] or 0, 2),
-            'avg_ocean': round(r['avg_ocean'] or 0, 2),
-        } for r in results]
+            'periodo': f"{_MESES_NOMBRES.get(r['mes'], r['mes'])}/{r['anio']}",
+            'count': r['total'],
+            'avg_all_in': round(float(r['trend_avg_all_in'] or 0), 2),
+            'avg_ocean': round(float(r['trend_avg_ocean'] or 0), 2),
+        } for r in rows]
         return list(reversed(result))
 
     @api.model
-    def _get_variaciones_mensuales(self):
-        tendencia = self._get_tendencia_mensual(meses=2)
+    def _get_variaciones_mensuales(self, aggregates=None):
+        tendencia = self._get_tendencia_mensual(meses=2, aggregates=aggregates)
         if len(tendencia) < 2:
             return {'variacion_all_in': 0, 'variacion_ocean': 0, 'tendencia': 'estable'}
         
@@ -482,92 +810,479 @@ class FreightTariff(models.Model):
         }
 
     @api.model
-    def _get_alertas(self):
+    def _get_alertas(self, aggregates=None):
+        aggregates = aggregates or self._get_dashboard_aggregates(['global'])
+        row = aggregates['global'][0]
         alertas = []
-        today = date.today()
-        current_year = str(today.year)
-        current_month = str(today.month).zfill(2)
-        
+
         # Alerta de expiración este mes (aproximación basada en año)
-        expiran_este_mes = self.search_count([
-            ('anio', '=', current_year), ('mes', '=', current_month), ('state', '=', 'active')
-        ])
+        expiran_este_mes = row['expiran_este_mes']
         if expiran_este_mes > 0:
             alertas.append({'tipo': 'warning', 'mensaje': f'{expiran_este_mes} tarifa(s) expiran este mes', 'icono': 'fa-clock-o'})
         
-        tarifas_viejas = self.search_count([('state', '=', 'expired')])
+        tarifas_viejas = row['expiradas']
         if tarifas_viejas > 10:
             alertas.append({'tipo': 'info', 'mensaje': f'{tarifas_viejas} tarifas expiradas en el sistema', 'icono': 'fa-archive'})
         
-        forwarders_activos_ids = self.search([('state', '=', 'active')]).mapped('forwarder_id')
-        count_f = len(set(forwarders_activos_ids.ids))
+        count_f = row['forwarders_activos']
         if count_f < 3:
             alertas.append({'tipo': 'danger', 'mensaje': f'Solo {count_f} forwarder(s) con tarifas vigentes', 'icono': 'fa-exclamation-triangle'})
         
         return alertas
 
     @api.model
-    def _get_comparativo_equipos(self):
+    def _get_comparativo_equipos(self, aggregates=None):
+        aggregates = aggregates or self._get_dashboard_aggregates(['equipo'])
         equipos_comunes = ['20st', '40st', '40hc', '20rf', '40rf', 'lcl']
+        equipo_labels = dict(self._fields['equipo'].selection)
+        by_equipo = {r['equipo']: r for r in aggregates['equipo'] if r['activas']}
         result = []
         for equipo in equipos_comunes:
-            tarifas = self.search([('equipo', '=', equipo), ('state', '=', 'active')])
-            if tarifas:
+            r = by_equipo.get(equipo)
+            if r:
                 result.append({
                     'equipo': equipo,
-                    'label': dict(self._fields['equipo'].selection).get(equipo, equipo),
-                    'count': len(tarifas),
-                    'min': min(t.all_in for t in tarifas),
-                    'max': max(t.all_in for t in tarifas),
-                    'avg': round(sum(t.all_in for t in tarifas) / len(tarifas), 2),
+                    'label': equipo_labels.get(equipo, equipo),
+                    'count': r['activas'],
+                    'min': float(r['min_all_in'] or 0),
+                    'max': float(r['max_all_in'] or 0),
+                    'avg': round(float(r['avg_all_in'] or 0), 2),
                 })
         return result
 
     @api.model
     def get_tarifa_mas_economica(self, pol_id=None, pod_id=None, equipo=None):
-        domain = [('state', '=', 'active')]
-        if pol_id: domain.append(('pol_id', '=', pol_id))
-        if pod_id: domain.append(('pod_id', '=', pod_id))
-        if equipo: domain.append(('equipo', '=', equipo))
-        tarifas = self.search(domain, order='all_in asc', limit=5)
-        return [{'id': t.id, 'name': t.name, 'forwarder': t.forwarder_id.name, 'naviera': t.naviera_id.name or '-', 'all_in': t.all_in, 'transit_time': t.transit_time} for t in tarifas]
+        return self.get_tarifas_mas_economicas([(pol_id, pod_id, equipo)])[0]
+
+    @api.model
+    @instrumented('freight.tariff.get_tarifas_mas_economicas',
+                  records=lambda result: sum(len(tarifas) for tarifas in result))
+    def get_tarifas_mas_economicas(self, lanes, limit=5):
+        """Cotización por lote: las N tarifas vigentes más económicas de cada
+        carril [(pol_id, pod_id, equipo), ...]. Un valor vacío en el carril
+        no filtra ese campo, igual que get_tarifa_mas_economica.
+
+        Cada carril es un top-N sobre _cheapest_lane_idx, cacheado por
+        versión del catálogo; los carriles sin caché se resuelven juntos en
+        UNA consulta (_query_cheapest_tariff_ids) y los nombres de
+        forwarder/naviera se leen una vez para todo el lote. Respeta las
+        reglas de registro del usuario (entonces sin caché).
+
+        :return: lista de resultados, en el mismo orden que los carriles
+        """
+        if not lanes:
+            return []
+        self.check_access('read')
+        lanes = [
+            (int(pol_id) if pol_id else None, int(pod_id) if pod_id else None, equipo or None)
+            for pol_id, pod_id, equipo in lanes
+        ]
+        rules = self._read_rules_sql()
+        derived = self._catalog_derived() if rules is None else None
+        ids_by_lane = {}
+        if derived is not None:
+            for lane in lanes:
+                ids = derived.get(('cheapest', lane, limit))
+                if ids is not None:
+                    ids_by_lane[lane] = ids
+        missing = [lane for lane in dict.fromkeys(lanes) if lane not in ids_by_lane]
+        if missing:
+            fetched = self._query_cheapest_tariff_ids(missing, limit, rules)
+            for lane in missing:
+                ids_by_lane[lane] = fetched[lane]
+                if derived is not None:
+                    derived[('cheapest', lane, limit)] = fetched[lane]
+
+        tarifas = self.browse({tid for ids in ids_by_lane.values() for tid in ids})
+        tarifas.fetch(['name', 'forwarder_id', 'naviera_id', 'all_in', 'transit_time'])
+        # Nombres de forwarders y navieras en UNA lectura para todo el lote.
+        (tarifas.forwarder_id | tarifas.naviera_id).fetch(['name'])
+        return [[{
+            'id': t.id,
+            'name': t.name or False,
+            'forwarder': t.forwarder_id.name or False,
+            'naviera': t.naviera_id.name or '-',
+            'all_in': float(t.all_in or 0.0),
+            'transit_time': t.transit_time or 0,
+        } for t in self.browse(ids_by_lane[lane]).with_prefetch(tarifas._prefetch_ids)]
+            for lane in lanes]
+
+    @api.model
+    def _query_cheapest_tariff_ids(self, lanes, limit, rules=None):
+        """{carril: ids de las N vigentes más económicas (all_in asc)}.
+
+        Los carriles se agrupan por las llaves que traen: cada grupo es un
+        VALUES con CROSS JOIN LATERAL cuyo WHERE solo compara con igualdad
+        esas columnas, así cada carril es un top-N sobre _cheapest_lane_idx
+        (sin ordenar todas sus coincidencias). Todo va en UNA sentencia."""
+        self.flush_model(['pol_id', 'pod_id', 'equipo', 'all_in', 'state', 'active'])
+        casts = {'pol_id': 'int', 'pod_id': 'int', 'equipo': 'varchar'}
+        by_shape = defaultdict(list)
+        for idx, lane in enumerate(lanes):
+            by_shape[tuple(value is not None for value in lane)].append(idx)
+        queries = []
+        for shape, indexes in by_shape.items():
+            columns = [col for col, present in zip(casts, shape) if present]
+            values = SQL(', ').join(
+                SQL('(%s)', SQL(', ').join([
+                    SQL('%s', idx),
+                    *(SQL('%s::%s', value, SQL(casts[col]))
+                      for col, value in zip(casts, lanes[idx]) if value is not None),
+                ]))
+                for idx in indexes
+            )
+            queries.append(SQL("""
+                SELECT lanes.idx, top.id, top.all_in
+                  FROM (VALUES %(values)s) AS lanes(%(columns)s)
+          CROSS JOIN LATERAL (
+                    SELECT ft.id, ft.all_in
+                      FROM freight_tariff ft
+                     WHERE ft.state = 'active' AND ft.active = true
+                       AND %(match)s AND %(rules)s
+                  ORDER BY ft.all_in, ft.id
+                     LIMIT %(limit)s
+                ) top
+            """,
+                values=values,
+                columns=SQL(', ').join(SQL.identifier(col) for col in ['idx', *columns]),
+                match=SQL(' AND ').join([
+                    SQL('TRUE'),
+                    *(SQL('%s = %s', SQL.identifier('ft', col), SQL.identifier('lanes', col))
+                      for col in columns),
+                ]),
+                rules=rules or SQL('TRUE'),
+                limit=limit,
+            ))
+        self.env.cr.execute(SQL(
+            "%s ORDER BY 1, 3, 2", SQL(' UNION ALL ').join(queries),
+        ))
+        ids = [[] for _lane in lanes]
+        for idx, tid, _all_in in self.env.cr.fetchall():
+            ids[idx].append(tid)
+        return {lane: tuple(ids[idx]) for idx, lane in enumerate(lanes)}
+
+    @api.model
+    def _read_rules_sql(self):
+        """Reglas de registro de lectura del usuario como condición SQL
+        (alias ft), o None si no le aplica ninguna (superusuario o sin
+        reglas): el caso común, que deja intacto el top-N sobre el índice."""
+        if self.env.su or not self.env['ir.rule']._get_rules(self._name, 'read'):
+            return None
+        return SQL('ft.id IN %s', self._search([]).subselect())
 
     # =====================================================
-    # MÉTODOS AUXILIARES Y CRUD
+    # CATÁLOGO VIGENTE CACHEADO (compartido por el worker)
     # =====================================================
+    # La caché va por VERSIÓN del catálogo (secuencia
+    # freight_tariff_catalog_version_seq): cada transacción lee la versión
+    # una vez y, si cambió, el worker descarta lo cacheado de la anterior.
+    # La versión sube DESPUÉS de confirmar la transacción que modificó el
+    # catálogo (nextval: sin bloqueos, los escritores concurrentes nunca se
+    # esperan entre sí), así nadie cachea datos viejos bajo la versión nueva;
+    # ninguna otra caché del registro se toca. Los resultados son
+    # compartidos: tratarlos como inmutables.
+
+    @api.model
+    def _catalog_version(self):
+        """Versión del catálogo vista por esta transacción, o None si la
+        propia transacción ya lo modificó (entonces se calcula sin caché)."""
+        data = self.env.cr.precommit.data
+        if data.get(_CATALOG_DIRTY_KEY):
+            return None
+        version = data.get(_CATALOG_VERSION_KEY)
+        if version is None:
+            self.env.cr.execute("SELECT last_value FROM freight_tariff_catalog_version_seq")
+            version = data[_CATALOG_VERSION_KEY] = self.env.cr.fetchone()[0]
+        return version
+
+    @api.model
+    def _catalog_changed(self):
+        """Marca el catálogo como modificado: esta transacción deja de usar
+        la caché y, ya confirmada, sube la versión UNA vez para que cada
+        worker lo recargue en su siguiente lectura."""
+        cr = self.env.cr
+        data = cr.precommit.data
+        data.pop(_CATALOG_VERSION_KEY, None)
+        if data.get(_CATALOG_DIRTY_KEY):
+            return
+        data[_CATALOG_DIRTY_KEY] = True
 
-    def _get_or_create_tag(self, tag_name):
-        return self.env['res.partner']._tarifario_get_tag(tag_name)
+        def bump_catalog_version():
+            # Tras el commit (precommit.data ya se vació): nextval no es
+            # transaccional, persiste aunque el cursor no vuelva a confirmar.
+            cr.execute("SELECT nextval('freight_tariff_catalog_version_seq')")
 
-    def _assign_tag_to_partner(self, partner_id, tag):
-        if partner_id:
-            partner = self.env['res.partner'].browse(partner_id)
-            if tag.id not in partner.category_id.ids:
-                partner.write({'category_id': [(4, tag.id)]})
+        cr.postcommit.add(bump_catalog_version)
+
+    @api.model
+    def _catalog_derived(self):
+        """LRU de derivados de la versión vista por esta transacción, o None
+        si no debe usarse caché (catálogo modificado en la transacción, o
+        foto anterior a la ya cacheada por el worker)."""
+        version = self._catalog_version()
+        if version is None:
+            return None
+        dbname = self.env.cr.dbname
+        slot = _CATALOG_SLOTS.get(dbname)
+        if slot is None or slot.version < version:
+            slot = _CATALOG_SLOTS[dbname] = _CatalogSlot(version, LRU(_CATALOG_DERIVED_SIZE))
+        elif slot.version > version:
+            return None
+        return slot.derived
+
+    @api.model
+    def _catalog_cached(self, key, build):
+        """``build()`` cacheado por worker bajo (versión del catálogo, key)."""
+        derived = self._catalog_derived()
+        if derived is None:
+            return build()
+        value = derived.get(key)
+        if value is None:
+            value = derived[key] = build()
+        return value
+
+    @api.model
+    def _catalog_cache_clear(self):
+        """Vacía la caché del catálogo de este worker (mediciones en frío)."""
+        _CATALOG_SLOTS.pop(self.env.cr.dbname, None)
+
+    @api.model
+    def _get_active_tariff_catalog(self):
+        """Catálogo vigente compacto (ActiveTariff), del más reciente al más
+        antiguo (mismo orden que _order). Una lectura por worker y por
+        versión, en vez de un search por cada OC o recepción."""
+        return self._catalog_cached('catalog', self._load_active_tariff_catalog)
+
+    @api.model
+    def _load_active_tariff_catalog(self):
+        self.flush_model()
+        self.env.cr.execute("""
+            SELECT id, country_id, forwarder_id, naviera_id, pol_id, pod_id,
+                   equipo, all_in
+              FROM freight_tariff
+             WHERE state = 'active' AND active = true
+          ORDER BY create_date DESC, id DESC
+        """)
+        return tuple(
+            ActiveTariff(*row[:7], float(row[7] or 0.0))
+            for row in self.env.cr.fetchall()
+        )
+
+    @api.model
+    def _get_route_availability_index(self):
+        """Índice de las combinaciones vigentes (país, forwarder, naviera,
+        POL, POD) para la cascada de la OC. Cada nivel se indexa también con
+        None = 'sin elegir', así la OC resuelve sus dominios con lookups de
+        diccionario sin importar el tamaño del tarifario."""
+        return self._catalog_cached(
+            'route_index', lambda: self._build_route_index(self._get_active_tariff_catalog()))
+
+    @api.model
+    def _build_route_index(self, tariffs):
+        countries = set()
+        forwarders = defaultdict(set)
+        navieras = defaultdict(set)
+        pols = defaultdict(set)
+        pods = defaultdict(set)
+        for t in tariffs:
+            countries.add(t.country_id)
+            for c in {t.country_id, None}:
+                forwarders[c].add(t.forwarder_id)
+                for f in {t.forwarder_id, None}:
+                    navieras[c, f].add(t.naviera_id)
+                    pols[c, f].add(t.pol_id)
+                    for p in {t.pol_id, None}:
+                        pods[c, f, p].add(t.pod_id)
+
+        def freeze(index):
+            return {key: tuple(i for i in ids if i) for key, ids in index.items()}
+
+        return {
+            'countries': tuple(c for c in countries if c),
+            'forwarders': freeze(forwarders),
+            'navieras': freeze(navieras),
+            'pols': freeze(pols),
+            'pods': freeze(pods),
+        }
+
+    @api.model
+    def _get_active_tariffs_by_route(self, country_id=None, pol_id=None, pod_id=None):
+        """Tarifas vigentes de la ruta (None = sin filtrar ese campo), de la
+        más reciente a la más antigua."""
+        return self._catalog_cached(('by_route', country_id, pol_id, pod_id), lambda: tuple(
+            t for t in self._get_active_tariff_catalog()
+            if (not country_id or t.country_id == country_id)
+            and (not pol_id or t.pol_id == pol_id)
+            and (not pod_id or t.pod_id == pod_id)
+        ))
+
+    # =====================================================
+    # VIGENCIA POR FECHA (índice GiST sobre valid_from/valid_to)
+    # =====================================================
+
+    @api.model
+    def _valid_on_sql(self, on_date):
+        """Condición SQL (alias ft) 'vigente en la fecha': contención en el
+        rango indexado y, como los meses pueden no ser contiguos, el mes
+        exacto en la expansión de vigencia. Sin rango = siempre vigente.
+
+        No filtra por state: una fecha pasada incluye tarifas hoy expiradas
+        (consulta histórica); la cascada de la OC agrega state = 'active'."""
+        return SQL("""
+            ft.active = true
+            AND daterange(ft.valid_from, ft.valid_to, '[]') @> %(on_date)s
+            AND (ft.valid_from IS NULL OR EXISTS (
+                SELECT 1 FROM freight_tariff_validity v
+                 WHERE v.tariff_id = ft.id
+                   AND v.period = (EXTRACT(YEAR FROM %(on_date)s) * 100
+                                   + EXTRACT(MONTH FROM %(on_date)s))::int
+            ))
+        """, on_date=on_date)
+
+    @api.model
+    def get_tariffs_valid_on(self, on_date, country_id=None, forwarder_id=None,
+                             naviera_id=None, pol_id=None, pod_id=None, equipo=None):
+        """Tarifas vigentes en ``on_date`` para la ruta indicada (un valor
+        vacío no filtra ese campo), de la más reciente a la más antigua: UNA
+        consulta sobre el índice de rango."""
+        self.check_access('read')
+        self.flush_model()
+        self.env['freight.tariff.validity'].flush_model()
+        conditions = [self._valid_on_sql(SQL('%s::date', fields.Date.to_date(on_date)))]
+        for column, value in (('country_id', country_id), ('forwarder_id', forwarder_id),
+                              ('naviera_id', naviera_id), ('pol_id', pol_id),
+                              ('pod_id', pod_id), ('equipo', equipo)):
+            if value:
+                conditions.append(SQL('%s = %s', SQL.identifier('ft', column), value))
+        self.env.cr.execute(SQL(
+            "SELECT ft.id FROM freight_tariff ft WHERE %s ORDER BY ft.create_date DESC, ft.id DESC",
+            SQL(' AND ').join(conditions),
+        ))
+        return self.browse(row[0] for row in self.env.cr.fetchall())
+
+    @api.model
+    def _get_route_availability_index_by_date(self, dates):
+        """Como _get_route_availability_index, pero con las tarifas VIGENTES
+        (state = 'active', misma regla de la cascada) cuya vigencia cubre
+        cada fecha (p. ej. el ETD de varias OC): {fecha: índice}.
+
+        La vigencia es mensual (valid_from/valid_to caen en bordes de mes),
+        así que el índice se cachea por periodo AAAAMM y versión del
+        catálogo: el onchange de la OC es un lookup; los periodos sin caché
+        se resuelven juntos en UNA consulta."""
+        periods = {
+            d: d.year * 100 + d.month
+            for d in {fields.Date.to_date(d) for d in dates if d}
+        }
+        if not periods:
+            return {}
+        derived = self._catalog_derived()
+        by_period = {}
+        if derived is not None:
+            for period in set(periods.values()):
+                index = derived.get(('route_index', period))
+                if index is not None:
+                    by_period[period] = index
+        missing = sorted(set(periods.values()) - set(by_period))
+        if missing:
+            self.flush_model()
+            self.env['freight.tariff.validity'].flush_model()
+            self.env.cr.execute(SQL("""
+                SELECT d.on_date, ft.id, ft.country_id, ft.forwarder_id, ft.naviera_id,
+                       ft.pol_id, ft.pod_id, ft.equipo, ft.all_in
+                  FROM UNNEST(%(dates)s::date[]) AS d(on_date)
+                  JOIN freight_tariff ft ON ft.state = 'active' AND %(valid)s
+              ORDER BY d.on_date, ft.create_date DESC, ft.id DESC
+            """,
+                dates=[date(period // 100, period % 100, 1) for period in missing],
+                valid=self._valid_on_sql(SQL('d.on_date')),
+            ))
+            tariffs = {period: [] for period in missing}
+            for row in self.env.cr.fetchall():
+                tariffs[row[0].year * 100 + row[0].month].append(
+                    ActiveTariff(*row[1:8], float(row[8] or 0.0)))
+            for period, period_tariffs in tariffs.items():
+                by_period[period] = self._build_route_index(period_tariffs)
+                if derived is not None:
+                    derived[('route_index', period)] = by_period[period]
+        return {d: by_period[period] for d, period in periods.items()}
+
+    # =====================================================
+    # MÉTODOS AUXILIARES Y CRUD
+    # =====================================================
 
     @api.model_create_multi
     def create(self, vals_list):
-        tags = {
-            'forwarder_id': self._get_or_create_tag('Forwarder'),
-            'naviera_id': self._get_or_create_tag('Naviera'),
-            'pol_id': self._get_or_create_tag('POL'),
-            'pod_id': self._get_or_create_tag('POD'),
-        }
-        for vals in vals_list:
-            for field, tag in tags.items():
-                if vals.get(field):
-                    self._assign_tag_to_partner(vals.get(field), tag)
-        return super().create(vals_list)
+        # Etiquetas de los partners: UNA escritura por etiqueta para los
+        # partners distintos del lote. El importador masivo ya las aplica
+        # por su cuenta (tarifario_skip_partner_tag).
+        if not self.env.context.get('tarifario_skip_partner_tag'):
+            self.env['res.partner']._tarifario_assign_tags({
+                tag_name: {vals.get(field) for vals in vals_list}
+                for field, tag_name in _PARTNER_TAG_FIELDS.items()
+            })
+        records = super().create(vals_list)
+        self.env['freight.tariff.validity']._sync(records)
+        self.env['freight.tariff.kpi']._refresh_buckets(records._kpi_bucket_keys())
+        # Capturadas con vigencia ya vencida: nacen expiradas.
+        self.env['freight.tariff.history']._record(
+            records.filtered(lambda t: t.state == 'expired'), 'expired')
+        self._catalog_changed()
+        return records
 
     def write(self, vals):
-        field_tag_map = {
-            'forwarder_id': 'Forwarder',
-            'naviera_id': 'Naviera',
-            'pol_id': 'POL',
-            'pod_id': 'POD',
-        }
-        for field, tag_name in field_tag_map.items():
-            if vals.get(field):
-                tag = self._get_or_create_tag(tag_name)
-                self._assign_tag_to_partner(vals[field], tag)
-        return super().write(vals)
\ No newline at end of file
+        self.env['res.partner']._tarifario_assign_tags({
+            tag_name: {vals[field]}
+            for field, tag_name in _PARTNER_TAG_FIELDS.items()
+            if vals.get(field)
+        })
+        # Snapshot de KPIs: se refrescan los buckets de ANTES y DESPUÉS.
+        keys = self._kpi_bucket_keys() if _KPI_TRIGGER_FIELDS.intersection(vals) else None
+        # Transición a 'expired' (state escrito directo o recalculado desde
+        # valid_to): se registra en el histórico en el momento.
+        state_before = (
+            {rec.id: rec.state for rec in self}
+            if _STATE_TRIGGER_FIELDS.intersection(vals) else None
+        )
+        res = super().write(vals)
+        if 'anio' in vals or 'mes_ids' in vals:
+            self.env['freight.tariff.validity']._sync(self)
+        if state_before is not None:
+            self.env['freight.tariff.history']._record(
+                self.filtered(lambda t: t.state == 'expired' and state_before[t.id] != 'expired'),
+                'expired',
+            )
+        if keys is not None:
+            for kpi, kpi_keys in self._kpi_bucket_keys().items():
+                keys[kpi] |= kpi_keys
+            self.env['freight.tariff.kpi']._refresh_buckets(keys)
+        if 'active' in vals and not vals['active']:
+            self.env['freight.tariff.history']._record(self, 'archived')
+        if _TARIFF_CACHE_FIELDS.intersection(vals):
+            self._catalog_changed()
+        return res
+
+    def unlink(self):
+        keys = self._kpi_bucket_keys()
+        res = super().unlink()
+        self.env['freight.tariff.kpi']._refresh_buckets(keys)
+        self._catalog_changed()
+        return res
+
+    def _kpi_bucket_keys(self):
+        """Buckets del snapshot de KPIs a los que pertenecen estas tarifas:
+        {kpi: {tupla de llaves}}, con None donde la columna va vacía."""
+        keys = defaultdict(set)
+        for rec in self:
+            values = {}
+            for col in _DASHBOARD_GROUP_COLUMNS:
+                value = rec[col]
+                values[col] = (value.id if isinstance(value, models.BaseModel) else value) or None
+            for kpi in SNAPSHOT_KPIS:
+                if kpi == 'tendencia':
+                    # Un bucket por cada mes de vigencia (ver validity_ids).
+                    for code in rec.mes_ids.mapped('code'):
+                        keys[kpi].add((values['anio'], code or None))
+                    continue
+                keys[kpi].add(tuple(values[col] for col in _DASHBOARD_GROUPING_SETS[kpi]))
+        return keys
\ No newline at end of file
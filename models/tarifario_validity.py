@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Vigencia EXPANDIDA del tarifario: una fila por (tarifa, año, mes).
+
+El campo legacy 'mes' solo guarda el primer mes elegido; aquí cada mes de
+mes_ids tiene su fila, con el periodo como entero AAAAMM indexado. La
+tendencia, la expiración y "vigente en el mes X" son consultas de rango
+sobre este índice, sin unir la relación mes_ids en cada lectura. Se
+mantiene al día desde create/write de freight.tariff (_sync).
+"""
+from odoo import models, fields, api
+from odoo.tools import SQL
+
+from .tarifario_master import _anio_int_sql
+
+
+class FreightTariffValidity(models.Model):
+    _name = 'freight.tariff.validity'
+    _description = 'Vigencia mensual del Tarifario'
+    _log_access = False
+    _order = 'period, id'
+
+    tariff_id = fields.Many2one(
+        'freight.tariff', string='Tarifa', required=True,
+        ondelete='cascade', readonly=True,
+    )
+    anio = fields.Char(string='Año', readonly=True)
+    mes = fields.Char(string='Mes', readonly=True)
+    # AAAAMM (vacío si el año no es numérico): vuelve cualquier ventana de
+    # meses una condición de rango.
+    period = fields.Integer(string='Periodo', readonly=True)
+
+    _tariff_mes_uniq = models.UniqueIndex('(tariff_id, mes)')
+    _period_idx = models.Index('(period, tariff_id)')
+    _anio_mes_idx = models.Index('(anio, mes)')
+
+    def init(self):
+        # Primera instalación: expande las tarifas existentes y rehace la
+        # tendencia del snapshot de KPIs (antes agrupada por el mes legacy).
+        self.env.cr.execute("SELECT 1 FROM freight_tariff_validity LIMIT 1")
+        if self.env.cr.fetchone():
+            return
+        self._sync_where(SQL('TRUE'))
+        self.env.cr.execute("SELECT 1 FROM freight_tariff_validity LIMIT 1")
+        if self.env.cr.fetchone():
+            self.env['freight.tariff.kpi']._rebuild(kpis=['tendencia'])
+
+    @api.model
+    def _period_sql(self, anio, mes):
+        """Expresión SQL del periodo AAAAMM (NULL si no es interpretable)."""
+        return SQL(
+            "CASE WHEN %(mes)s ~ '^(0?[1-9]|1[0-2])$' THEN %(anio)s * 100 + %(mes)s::int END",
+            anio=_anio_int_sql(anio), mes=mes,
+        )
+
+    @api.model
+    def _sync_where(self, where):
+        """Re-expande las tarifas que cumplen ``where`` (SQL sobre el alias
+        ft): un DELETE y un INSERT … SELECT sobre la relación de meses."""
+        mes_field = self.env['freight.tariff']._fields['mes_ids']
+        self.env.cr.execute(SQL(
+            "DELETE FROM freight_tariff_validity v USING freight_tariff ft "
+            "WHERE v.tariff_id = ft.id AND %s", where,
+        ))
+        self.env.cr.execute(SQL("""
+            INSERT INTO freight_tariff_validity (tariff_id, anio, mes, period)
+            SELECT ft.id, ft.anio, m.code, %(period)s
+              FROM freight_tariff ft
+              JOIN %(rel)s rel ON rel.%(col1)s = ft.id
+              JOIN freight_tariff_month m ON m.id = rel.%(col2)s
+             WHERE %(where)s
+            ON CONFLICT (tariff_id, mes) DO NOTHING
+        """,
+            period=self._period_sql(SQL('ft.anio'), SQL('m.code')),
+            rel=SQL.identifier(mes_field.relation),
+            col1=SQL.identifier(mes_field.column1),
+            col2=SQL.identifier(mes_field.column2),
+            where=where,
+        ))
+        self.invalidate_model()
+
+    @api.model
+    def _sync(self, tariffs):
+        if not tariffs:
+            return
+        tariffs.flush_recordset(['anio', 'mes_ids'])
+        self._sync_where(SQL('ft.id IN %s', tuple(tariffs.ids)))
+        tariffs.invalidate_recordset(['validity_ids'])
+
+    @api.model
+    def _get_tariff_ids_valid_in(self, anio, mes):
+        """Tarifas (ids) vigentes en el mes indicado: un lookup en el índice
+        de periodo."""
+        self.env.cr.execute(
+            "SELECT tariff_id FROM freight_tariff_validity WHERE period = %s",
+            (int(anio) * 100 + int(mes),),
+        )
+        return [row[0] for row in self.env.cr.fetchall()]
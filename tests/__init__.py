@@ -0,0 +1,5 @@
+from . import test_promedios
+from . import test_perf_dashboard
+from . import test_perf_purchase
+from . import test_costing_receipt
+from . import test_costing_publication
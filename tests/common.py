@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""Datos base de las pruebas del tarifario: partners etiquetados, país y
+generadores de tarifas, órdenes de compra y recepciones."""
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from datetime import date
+from unittest.mock import patch
+
+from odoo import Command
+from odoo.tests import TransactionCase
+
+_logger = logging.getLogger(__name__)
+
+# Línea base de las rutas calientes, MEDIDA en el entorno de referencia:
+# {ruta: {'queries': n, 'seconds': s}}. Para (re)grabarla, correr la suite
+# con TARIFARIO_PERF_RECORD=1 (--test-tags tarifario_perf).
+PERF_BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'perf_baseline.json')
+PERF_RECORD = bool(os.environ.get('TARIFARIO_PERF_RECORD'))
+# El tiempo depende de la máquina: solo se registra en el log, salvo que se
+# pida compararlo (TARIFARIO_PERF_CHECK_TIME=1) con esta holgura (fracción).
+PERF_CHECK_TIME = bool(os.environ.get('TARIFARIO_PERF_CHECK_TIME'))
+PERF_TIME_TOLERANCE = 1.0
+
+_EQUIPOS = ('20st', '40st', '40hc', '40rf')
+
+# Campos de costeo de la plantilla (x_*): los define la personalización de
+# inventario, no este módulo; el costeo los escribe solo si existen.
+_COSTING_FIELDS = {
+    'x_origin_country_id': ('many2one', 'res.country'),
+    'x_pol_id': ('many2one', 'res.partner'),
+    'x_pod_id': ('many2one', 'res.partner'),
+    'x_naviera_id': ('many2one', 'res.partner'),
+    'x_forwarder_id': ('many2one', 'res.partner'),
+    'x_container_capacity': ('float', None),
+    'x_arancel_pct': ('float', None),
+}
+
+
+class TarifarioCommon(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env = cls.env(context=dict(cls.env.context, tracking_disable=True))
+        cls.Tariff = cls.env['freight.tariff']
+        cls.country = cls.env.ref('base.mx')
+        cls.forwarder = cls._create_partners('Forwarder', 1)
+        cls.naviera = cls._create_partners('Naviera', 1)
+        cls.pol = cls._create_partners('POL', 1)
+        cls.pod = cls._create_partners('POD', 1)
+        cls.months = cls.env['freight.tariff.month'].search([])
+        cls.year = str(date.today().year)
+
+    @classmethod
+    def _create_partners(cls, tag_name, count):
+        """``count`` partners ya etiquetados con ``tag_name``."""
+        return cls.env['res.partner'].with_context(tarifario_partner_tag=tag_name).create([
+            {'name': f'{tag_name} Prueba {i}', 'is_company': True} for i in range(count)
+        ])
+
+    @classmethod
+    def _tariff_vals(cls, **vals):
+        """Valores de una tarifa vigente todo el año en curso."""
+        return {
+            'country_id': cls.country.id,
+            'forwarder_id': cls.forwarder.id,
+            'naviera_id': cls.naviera.id,
+            'pol_id': cls.pol.id,
+            'pod_id': cls.pod.id,
+            'anio': cls.year,
+            'mes_ids': [(6, 0, cls.months.ids)],
+            'equipo': '40hc',
+            **vals,
+        }
+
+    @classmethod
+    def _create_tariffs(cls, vals_list):
+        return cls.Tariff.create([cls._tariff_vals(**vals) for vals in vals_list])
+
+    @classmethod
+    def _add_costing_fields(cls):
+        """Crea en product.template los campos x_* que escribe el costeo
+        (campos manuales) si la base no los trae."""
+        Template = cls.env['product.template']
+        model_id = cls.env['ir.model']._get_id('product.template')
+        cls.env['ir.model.fields'].create([{
+            'name': name,
+            'model_id': model_id,
+            'field_description': name,
+            'ttype': ttype,
+            'relation': relation,
+            'state': 'manual',
+        } for name, (ttype, relation) in _COSTING_FIELDS.items() if name not in Template._fields])
+
+    # ==========================
+    # GENERADORES
+    # ==========================
+
+    @classmethod
+    def _generate_tariffs(cls, count, pods=None):
+        """``count`` tarifas vigentes repartidas entre los POD indicados y
+        los equipos más comunes, con costos distintos."""
+        pods = pods or cls.pod
+        return cls._create_tariffs([{
+            'pod_id': pods[i % len(pods)].id,
+            'equipo': _EQUIPOS[i % len(_EQUIPOS)],
+            'ocean_freight': 900.0 + (i * 37) % 1100,
+            'costo_exw': float((i * 13) % 250),
+            'ams_imo': 35.0,
+            'transit_time': 20 + i % 15,
+            'demoras': 7 + i % 14,
+        } for i in range(count)])
+
+    @classmethod
+    def _generate_products(cls, count):
+        return cls.env['product.product'].create([
+            {'name': f'Producto tarifario {i}', 'is_storable': True} for i in range(count)
+        ])
+
+    @classmethod
+    def _generate_purchase_orders(cls, count, products):
+        """``count`` OC internacionales con la ruta del tarifario capturada y
+        una línea por producto (un producto repetido da varias líneas)."""
+        return cls.env['purchase.order'].create([{
+            'partner_id': cls.forwarder.id,
+            'som_route_country_id': cls.country.id,
+            'som_route_forwarder_id': cls.forwarder.id,
+            'som_route_naviera_id': cls.naviera.id,
+            'som_route_pol_id': cls.pol.id,
+            'som_route_pod_id': cls.pod.id,
+            'order_line': [Command.create({
+                'product_id': product.id,
+                'product_qty': 10.0,
+                'price_unit': 100.0,
+                'som_container_capacity': 20.0,
+            }) for product in products],
+        } for _i in range(count)])
+
+    @classmethod
+    def _generate_receipts(cls, orders, costing=True):
+        """Confirma las OC y valida sus recepciones completas. Sin
+        ``costing`` la validación no costea: el costeo queda por medir."""
+        orders.button_confirm()
+        pickings = orders.picking_ids
+        for move in pickings.move_ids:
+            move.quantity = move.product_uom_qty
+        pickings.move_ids.picked = True
+        if costing:
+            pickings.button_validate()
+        else:
+            with patch.object(type(pickings), '_som_update_products_from_last_purchase', lambda self: None):
+                pickings.button_validate()
+        return pickings
+
+
+class TarifarioPerfCase(TarifarioCommon):
+    """Rutas calientes medidas en frío contra la línea base grabada
+    (tests/perf_baseline.json)."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with open(PERF_BASELINE_PATH, encoding='utf-8') as f:
+            cls.perf_baseline = json.load(f)
+
+    @contextmanager
+    def assertPerfBudget(self, name):
+        """Corre el bloque en frío (sin caché de registros ni del catálogo).
+        Sus consultas no pueden exceder las grabadas para ``name``; el
+        tiempo solo se registra (o se compara si PERF_CHECK_TIME). Con
+        PERF_RECORD, o si la ruta aún no tiene base, la medición se graba
+        en lugar de compararse."""
+        budget = self.perf_baseline.get(name)
+        record = PERF_RECORD or not budget
+        self.env.flush_all()
+        self.env.invalidate_all()
+        self.Tariff._catalog_cache_clear()
+        queries = self.env.cr.sql_log_count
+        start = time.perf_counter()
+        if record:
+            yield
+            self.env.flush_all()
+        else:
+            with self.assertQueryCount(budget['queries']):
+                yield
+        seconds = time.perf_counter() - start
+        queries = self.env.cr.sql_log_count - queries
+        _logger.info(
+            "[TARIFARIO] Rendimiento %s: %s consultas, %.3fs (base: %s).",
+            name, queries, seconds, budget or 'sin grabar',
+        )
+        if record:
+            self._record_perf_baseline(name, queries, seconds)
+        elif PERF_CHECK_TIME:
+            self.assertLessEqual(
+                seconds, budget['seconds'] * (1 + PERF_TIME_TOLERANCE),
+                f"{name}: {seconds:.3f}s excede la base de {budget['seconds']:.3f}s",
+            )
+
+    @classmethod
+    def _record_perf_baseline(cls, name, queries, seconds):
+        with open(PERF_BASELINE_PATH, encoding='utf-8') as f:
+            baseline = json.load(f)
+        baseline[name] = {'queries': queries, 'seconds': round(seconds, 4)}
+        with open(PERF_BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+            f.write('\n')
+        cls.perf_baseline[name] = baseline[name]
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import patch
+
+from odoo.tests import tagged
+
+from .common import TarifarioCommon
+
+_PRODUCTS = 5
+_ORDERS = 10
+
+
+@tagged('post_install', '-at_install')
+class TestCostingPublication(TarifarioCommon):
+    """Publicación de un cambio de ruta (_som_apply_costing_update): las
+    consultas por publicación no crecen con el número de OC, y cada
+    plantilla se escribe una sola vez aunque varias OC la compren."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls._add_costing_fields()
+        cls.new_naviera = cls._create_partners('Naviera', 1)
+        cls.new_forwarder = cls._create_partners('Forwarder', 1)
+        cls.new_pol = cls._create_partners('POL', 1)
+        cls.new_pod = cls._create_partners('POD', 1)
+        cls.products_single = cls._generate_products(_PRODUCTS)
+        cls.single = cls._generate_purchase_orders(1, cls.products_single)
+        cls.products_many = cls._generate_products(_PRODUCTS)
+        cls.many = cls._generate_purchase_orders(_ORDERS, cls.products_many)
+
+    def _publish(self, orders):
+        return orders._som_apply_costing_update(
+            naviera=self.new_naviera, forwarder=self.new_forwarder,
+            pol=self.new_pol, pod=self.new_pod,
+        )
+
+    def _assert_published(self, products):
+        templates = products.product_tmpl_id
+        self.assertEqual(templates.mapped('x_naviera_id'), self.new_naviera)
+        self.assertEqual(templates.mapped('x_forwarder_id'), self.new_forwarder)
+        self.assertEqual(templates.mapped('x_pol_id'), self.new_pol)
+        self.assertEqual(templates.mapped('x_pod_id'), self.new_pod)
+        self.assertEqual(templates.mapped('x_origin_country_id'), self.country)
+
+    def test_query_count_independent_of_orders(self):
+        self.env.flush_all()
+        self.env.invalidate_all()
+        queries = self.env.cr.sql_log_count
+        self._publish(self.single)
+        self.env.flush_all()
+        single = self.env.cr.sql_log_count - queries
+        self._assert_published(self.products_single)
+
+        self.env.invalidate_all()
+        with self.assertQueryCount(single):
+            self._publish(self.many)
+        self._assert_published(self.products_many)
+        self.assertTrue(all(self.many.order_line.mapped('som_costing_activated')))
+
+    def test_templates_written_once(self):
+        Template = type(self.env['product.template'])
+        written = []
+        write = Template.write
+
+        def spy(records, vals):
+            written.extend(records.ids)
+            return write(records, vals)
+
+        with patch.object(Template, 'write', spy):
+            self._publish(self.many)
+        self.assertCountEqual(written, self.products_many.product_tmpl_id.ids)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import patch
+
+from odoo.tests import tagged
+
+from .common import TarifarioCommon
+
+_PRODUCTS = 5
+_ORDERS = 4
+
+
+@tagged('post_install', '-at_install')
+class TestCostingReceipt(TarifarioCommon):
+    """Costeo de recepciones multi-línea: cada plantilla se escribe UNA vez
+    por lote (su estado final), no una vez por move."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls._add_costing_fields()
+        # Recepciones validadas SIN costear: el costeo se mide en la prueba.
+        cls.products_small = cls._generate_products(_PRODUCTS)
+        cls.small = cls._generate_receipts(
+            cls._generate_purchase_orders(1, cls.products_small), costing=False)
+        cls.products_large = cls._generate_products(_PRODUCTS)
+        cls.large = cls._generate_receipts(
+            cls._generate_purchase_orders(_ORDERS, cls.products_large), costing=False)
+
+    def test_templates_written_once(self):
+        Template = type(self.env['product.template'])
+        written = []
+        write = Template.write
+
+        def spy(records, vals):
+            written.extend(records.ids)
+            return write(records, vals)
+
+        self.assertEqual(len(self.large.move_ids), _ORDERS * _PRODUCTS)
+        with patch.object(Template, 'write', spy):
+            self.large._som_update_products_from_last_purchase()
+        templates = self.products_large.product_tmpl_id
+        self.assertCountEqual(written, templates.ids, "Cada plantilla se escribe exactamente una vez")
+        self.assertEqual(templates.mapped('x_pol_id'), self.pol)
+        self.assertEqual(templates.mapped('x_pod_id'), self.pod)
+        self.assertEqual(set(templates.mapped('x_container_capacity')), {20.0})
+        lines = self.large.move_ids.purchase_line_id
+        self.assertTrue(all(lines.mapped('som_costing_activated')))
+
+    def test_query_count_independent_of_moves(self):
+        self.env.flush_all()
+        self.env.invalidate_all()
+        queries = self.env.cr.sql_log_count
+        self.small._som_update_products_from_last_purchase()
+        self.env.flush_all()
+        single = self.env.cr.sql_log_count - queries
+        self.assertEqual(self.products_small.product_tmpl_id.mapped('x_pol_id'), self.pol)
+
+        # Cuatro veces los moves (mismas plantillas repetidas entre OC): las
+        # mismas consultas que una sola recepción.
+        self.env.invalidate_all()
+        with self.assertQueryCount(single):
+            self.large._som_update_products_from_last_purchase()
+        self.assertEqual(self.products_large.product_tmpl_id.mapped('x_pol_id'), self.pol)
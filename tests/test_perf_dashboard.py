@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import tagged
+
+from .common import TarifarioPerfCase
+
+_TARIFFS = 1000
+_LANES = 20
+
+
+@tagged('tarifario_perf', 'post_install', '-at_install')
+class TestPerfDashboard(TarifarioPerfCase):
+    """Dashboard y cotización por lote: consultas constantes sin importar el
+    tamaño del tarifario."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.pods = cls.pod | cls._create_partners('POD', _LANES - 1)
+        cls._generate_tariffs(_TARIFFS, pods=cls.pods)
+
+    def test_dashboard(self):
+        with self.assertPerfBudget('dashboard'):
+            data = self.Tariff.get_dashboard_data()
+        self.assertGreaterEqual(data['resumen']['activas'], _TARIFFS)
+
+    def test_cheapest_lanes(self):
+        lanes = [(self.pol.id, pod.id, '40hc') for pod in self.pods]
+        with self.assertPerfBudget('cheapest_lanes'):
+            results = self.Tariff.get_tarifas_mas_economicas(lanes)
+        self.assertEqual(len(results), _LANES)
+        for tarifas in results:
+            all_in = [t['all_in'] for t in tarifas]
+            self.assertTrue(all_in)
+            self.assertEqual(all_in, sorted(all_in))
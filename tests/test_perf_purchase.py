@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import tagged
+
+from .common import TarifarioPerfCase
+
+_TARIFFS = 500
+_ORDERS = 20
+_PRODUCTS = 5
+
+
+@tagged('tarifario_perf', 'post_install', '-at_install')
+class TestPerfPurchase(TarifarioPerfCase):
+    """Cascada de la OC, resolución del ALL-IN y costeo de recepciones: el
+    costo por lote no crece con el número de OC ni de moves."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls._add_costing_fields()
+        cls._generate_tariffs(_TARIFFS)
+        cls.products = cls._generate_products(_PRODUCTS)
+        cls.orders = cls._generate_purchase_orders(_ORDERS, cls.products)
+
+    def test_route_domains(self):
+        with self.assertPerfBudget('route_domains'):
+            self.orders._compute_som_route_domains()
+        for order in self.orders:
+            self.assertIn(self.country, order.som_allowed_country_ids)
+            self.assertIn(self.pod, order.som_allowed_pod_ids)
+
+    def test_tariff_all_in(self):
+        keys = [
+            (self.country.id, self.pol.id, self.pod.id, self.naviera.id, self.forwarder.id),
+            (self.country.id, self.pol.id, self.pod.id, self.naviera.id, None),
+            (self.country.id, self.pol.id, self.pod.id, None, None),
+        ] * _ORDERS
+        with self.assertPerfBudget('tariff_all_in'):
+            result = self.env['stock.picking']._som_tariff_all_in_bulk(keys)
+        self.assertTrue(all(result[key] > 0 for key in keys))
+
+    def test_update_products(self):
+        # Validadas sin costear: el bloque medido es el costeo completo.
+        pickings = self._generate_receipts(self.orders, costing=False)
+        self.assertEqual(set(pickings.mapped('state')), {'done'})
+        with self.assertPerfBudget('update_products'):
+            pickings._som_update_products_from_last_purchase()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import tagged
+
+from .common import TarifarioCommon
+
+# Campo del resultado → campo de la tarifa y decimales del redondeo.
+_PROMEDIOS = {
+    'all_in': ('all_in', 2),
+    'ocean_freight': ('ocean_freight', 2),
+    'ams_imo': ('ams_imo', 2),
+    'lib_seguro': ('lib_seguro', 2),
+    'costo_exw': ('costo_exw', 2),
+    'transit_time': ('transit_time', 1),
+    'demoras': ('demoras', 1),
+    'costo_total': ('all_in', 2),
+    'margen_pct': ('margen_estimado', 2),
+}
+
+
+@tagged('post_install', '-at_install')
+class TestPromediosActivos(TarifarioCommon):
+    """_get_promedios_activos (AVG en SQL) debe dar lo mismo que el cálculo
+    original en Python: sum(t.x or 0) / count sobre las tarifas vigentes."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls._create_tariffs([
+            {'ocean_freight': 1500.0, 'costo_exw': 120.5, 'ams_imo': 35.0,
+             'lib_seguro': 80.0, 'transit_time': 28, 'demoras': 14},
+            # Costos vacíos: cuentan como 0 en el promedio.
+            {'ocean_freight': 2100.0},
+            {'ocean_freight': 0.0, 'costo_exw': 0.0, 'transit_time': 0, 'demoras': 0},
+            {'ocean_freight': 980.75, 'ams_imo': 40.0, 'fee': 55.0, 'transit_time': 31},
+        ])
+        # Fuera del promedio: vencida y archivada.
+        cls._create_tariffs([
+            {'anio': str(int(cls.year) - 1), 'ocean_freight': 99999.0},
+            {'active': False, 'ocean_freight': 88888.0},
+        ])
+
+    def _python_promedios(self):
+        tarifas = self.Tariff.search([('state', '=', 'active')])
+        return {
+            key: round(sum(t[fname] or 0 for t in tarifas) / len(tarifas), digits)
+            for key, (fname, digits) in _PROMEDIOS.items()
+        }
+
+    def test_promedios_match_python_mean(self):
+        promedios = self.Tariff._get_promedios_activos()
+        expected = self._python_promedios()
+        self.assertEqual(set(promedios), set(_PROMEDIOS))
+        for key, value in expected.items():
+            self.assertAlmostEqual(promedios[key], value, places=_PROMEDIOS[key][1], msg=key)
+
+    def test_promedios_without_active_tariffs(self):
+        self.Tariff.search([('state', '=', 'active')]).write({'active': False})
+        promedios = self.Tariff._get_promedios_activos()
+        self.assertEqual(set(promedios), set(_PROMEDIOS))
+        self.assertTrue(all(value == 0 for value in promedios.values()))
@@ -0,0 +1,2 @@
+from . import tarifario_import
+from . import tarifario_archive
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Exporta y archiva el histórico de tarifas EXPIRADAS.
+
+Las expiradas se acumulan (_get_alertas avisa desde 10) y la lista y el
+dashboard las siguen barriendo. Este asistente las vuelca a un CSV
+comprimido (gzip) leyendo con un cursor de servidor (DECLARE/FETCH) en
+bloques de tamaño fijo — memoria acotada aunque sean años de histórico — y
+después las archiva (active = False) para adelgazar la tabla viva.
+"""
+import csv
+import gzip
+import hashlib
+import io
+import logging
+import shutil
+import tempfile
+from datetime import date
+
+from odoo import models, fields, _
+from odoo.exceptions import UserError
+from odoo.tools import SQL, split_every
+
+from ..models.tarifario_master import _COST_FIELDS, _anio_int_sql
+
+_logger = logging.getLogger(__name__)
+
+# Con almacenamiento de adjuntos en base de datos el archivo debe pasar por
+# memoria: se limita su tamaño (con filestore se copia por bloques).
+_MAX_DB_EXPORT_BYTES = 100 * 1024 * 1024
+_COPY_BLOCK = 1024 * 1024
+
+_EXPORT_HEADERS = (
+    'id', 'referencia', 'pais', 'forwarder', 'naviera', 'pol', 'pod', 'anio',
+    'meses', 'equipo', *_COST_FIELDS, 'all_in', 'transit_time', 'demoras',
+    'estado', 'creada',
+)
+
+
+class FreightTariffArchive(models.TransientModel):
+    _name = 'freight.tariff.archive'
+    _description = 'Exportar y archivar tarifas expiradas'
+
+    before_year = fields.Integer(
+        string='Año anterior a',
+        default=lambda self: date.today().year,
+        help='Solo tarifas expiradas con año de vigencia menor a este. '
+             'Con 0 se incluyen todas las expiradas.',
+    )
+    archive = fields.Boolean(
+        string='Archivar después de exportar', default=True,
+        help='Marca las tarifas exportadas como archivadas (active = False).',
+    )
+    chunk_size = fields.Integer(string='Filas por bloque', default=2000)
+
+    state = fields.Selection([('draft', 'Borrador'), ('done', 'Hecho')], default='draft')
+    exported_count = fields.Integer(string='Tarifas exportadas', readonly=True)
+    attachment_id = fields.Many2one('ir.attachment', string='Archivo', readonly=True)
+
+    def _export_query(self):
+        mes_field = self.env['freight.tariff']._fields['mes_ids']
+        return SQL("""
+            SELECT ft.id, ft.name, rc.code, fwd.name, nav.name, pol.name, pod.name,
+                   ft.anio,
+                   (SELECT STRING_AGG(m.code, ',' ORDER BY m.code)
+                      FROM %(rel)s rel
+                      JOIN freight_tariff_month m ON m.id = rel.%(col2)s
+                     WHERE rel.%(col1)s = ft.id),
+                   ft.equipo, %(costs)s, ft.all_in, ft.transit_time, ft.demoras,
+                   ft.state, ft.create_date
+              FROM freight_tariff ft
+         LEFT JOIN res_country rc ON rc.id = ft.country_id
+         LEFT JOIN res_partner fwd ON fwd.id = ft.forwarder_id
+         LEFT JOIN res_partner nav ON nav.id = ft.naviera_id
+         LEFT JOIN res_partner pol ON pol.id = ft.pol_id
+         LEFT JOIN res_partner pod ON pod.id = ft.pod_id
+             WHERE ft.active = true AND ft.state = 'expired' AND %(year)s
+          ORDER BY ft.id
+        """,
+            rel=SQL.identifier(mes_field.relation),
+            col1=SQL.identifier(mes_field.column1),
+            col2=SQL.identifier(mes_field.column2),
+            costs=SQL(', ').join(SQL.identifier('ft', col) for col in _COST_FIELDS),
+            year=SQL(
+                "%s < %s", _anio_int_sql(SQL('ft.anio')), self.before_year,
+            ) if self.before_year else SQL('TRUE'),
+        )
+
+    def _attach_export(self, buffer, name):
+        """Adjunta el archivo temporal sin cargarlo completo en memoria: con
+        filestore (lo normal) se calcula el checksum y se copia por bloques
+        a su ruta definitiva; con adjuntos en base de datos se lee completo,
+        limitado a _MAX_DB_EXPORT_BYTES."""
+        Attachment = self.env['ir.attachment'].sudo()
+        vals = {
+            'name': name,
+            'mimetype': 'application/gzip',
+            'res_model': self._name,
+            'res_id': self.id,
+        }
+        size = buffer.seek(0, io.SEEK_END)
+        buffer.seek(0)
+        if Attachment._storage() != 'file':
+            if size > _MAX_DB_EXPORT_BYTES:
+                raise UserError(_(
+                    "La exportación (%(size)s MB) excede el límite para adjuntos "
+                    "guardados en base de datos; acota el año o usa filestore.",
+                    size=size // (1024 * 1024),
+                ))
+            vals['raw'] = buffer.read()
+            return Attachment.create(vals)
+        sha = hashlib.sha1()
+        for block in iter(lambda: buffer.read(_COPY_BLOCK), b''):
+            sha.update(block)
+        checksum = sha.hexdigest()
+        fname, full_path = Attachment._get_path(b'', checksum)
+        buffer.seek(0)
+        with open(full_path, 'wb') as target:
+            shutil.copyfileobj(buffer, target, _COPY_BLOCK)
+        # Si la transacción se revierte, el recolector del filestore lo
+        # limpia (igual que _file_write).
+        Attachment._mark_for_gc(fname)
+        vals.update(store_fname=fname, checksum=checksum, file_size=size)
+        return Attachment.create(vals)
+
+    def action_export_archive(self):
+        self.ensure_one()
+        Tariff = self.env['freight.tariff']
+        Tariff.flush_model()
+        cr = self.env.cr
+        size = max(self.chunk_size or 2000, 1)
+        exported_ids = []
+        with tempfile.TemporaryFile() as buffer:
+            with gzip.GzipFile(fileobj=buffer, mode='wb') as gz:
+                text = io.TextIOWrapper(gz, encoding='utf-8', newline='')
+                writer = csv.writer(text)
+                writer.writerow(_EXPORT_HEADERS)
+                # Cursor de servidor: PostgreSQL entrega el resultado por
+                # bloques (FETCH) en vez de materializarlo en el worker.
+                cr.execute(SQL(
+                    "DECLARE freight_tariff_export NO SCROLL CURSOR FOR %s",
+                    self._export_query(),
+                ))
+                while True:
+                    cr.execute("FETCH FORWARD %s FROM freight_tariff_export", (size,))
+                    rows = cr.fetchall()
+                    if not rows:
+                        break
+                    writer.writerows(rows)
+                    exported_ids.extend(row[0] for row in rows)
+                cr.execute("CLOSE freight_tariff_export")
+                text.flush()
+                text.detach()
+            if not exported_ids:
+                raise UserError(_("No hay tarifas expiradas que cumplan el criterio."))
+            attachment = self._attach_export(
+                buffer, 'tarifas_expiradas_%s.csv.gz' % fields.Date.context_today(self))
+
+        if self.archive:
+            # Por bloques: cada escritura dispara histórico, vigencia y KPIs
+            # solo para su bloque, con la caché de registros acotada.
+            for ids in split_every(size, exported_ids):
+                Tariff.browse(ids).write({'active': False})
+                self.env.flush_all()
+                Tariff.invalidate_model()
+        _logger.info(
+            "[TARIFARIO] Histórico exportado (%s): %s tarifa(s) expiradas%s.",
+            attachment.name, len(exported_ids), ' y archivadas' if self.archive else '',
+        )
+        self.write({
+            'state': 'done',
+            'exported_count': len(exported_ids),
+            'attachment_id': attachment.id,
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""Importador masivo de tarifas (CSV / XLSX) para el tarifario internacional
+y el nacional.
+
+Pensado para las hojas mensuales de los forwarders (miles de filas): lee el
+archivo en streaming, resuelve país/partner/mes con mapas en memoria (una
+consulta por bloque, no por fila), etiqueta a cada partner UNA vez y crea
+en bloques. Una fila inválida se reporta sin abortar el archivo.
+"""
+import base64
+import csv
+import io
+import logging
+import unicodedata
+
+from odoo import models, fields, _
+from odoo.exceptions import UserError
+from odoo.tools.sql import escape_psql
+
+from ..models.tarifario_master import _PARTNER_TAG_FIELDS
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+# Encabezados aceptados (normalizados: minúsculas, sin acentos) → campo.
+_INTERNATIONAL_HEADERS = {
+    'pais': 'country_id', 'country': 'country_id', 'country_id': 'country_id',
+    'forwarder': 'forwarder_id', 'forwarder_id': 'forwarder_id',
+    'naviera': 'naviera_id', 'naviera_id': 'naviera_id',
+    'pol': 'pol_id', 'pol_id': 'pol_id',
+    'pod': 'pod_id', 'pod_id': 'pod_id',
+    'anio': 'anio', 'ano': 'anio', 'year': 'anio',
+    'meses': 'mes_ids', 'mes': 'mes_ids', 'mes_ids': 'mes_ids',
+    'equipo': 'equipo',
+    'costo_exw': 'costo_exw', 'exw': 'costo_exw',
+    'ocean_freight': 'ocean_freight', 'ocean': 'ocean_freight',
+    'ams_imo': 'ams_imo', 'lib_seguro': 'lib_seguro',
+    'maniobras': 'maniobras', 'vacio_lavado': 'vacio_lavado', 'aa': 'aa',
+    'flete_terrestre': 'flete_terrestre', 'profepa': 'profepa',
+    'uva': 'uva', 'fee': 'fee',
+    'transit_time': 'transit_time', 'demoras': 'demoras',
+    'notas': 'notes', 'notes': 'notes',
+}
+_NATIONAL_HEADERS = {
+    'pais': 'country_id', 'country': 'country_id', 'country_id': 'country_id',
+    'origen': 'origen', 'destino': 'destino',
+    'vehiculo': 'vehicle_type', 'vehicle_type': 'vehicle_type',
+    'costo': 'costo', 'transit_time': 'transit_time',
+    'notas': 'notas', 'notes': 'notas',
+}
+_FLOAT_FIELDS = (
+    'costo_exw', 'ocean_freight', 'ams_imo', 'lib_seguro', 'maniobras',
+    'vacio_lavado', 'aa', 'flete_terrestre', 'profepa', 'uva', 'fee', 'costo',
+)
+_INT_FIELDS = ('transit_time', 'demoras')
+
+
+def _normalize(text):
+    """Minúsculas, sin acentos ni espacios sobrantes (llave de los mapas)."""
+    text = unicodedata.normalize('NFKD', str(text or '').strip().lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def _to_float(value):
+    if value in (None, ''):
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip().replace('$', '').replace(' ', '')
+    # '1,234.50' → miles con coma; '1234,50' → decimal con coma.
+    text = text.replace(',', '') if '.' in text else text.replace(',', '.')
+    return float(text)
+
+
+class FreightTariffImport(models.TransientModel):
+    _name = 'freight.tariff.import'
+    _description = 'Importador masivo de tarifas'
+
+    target = fields.Selection([
+        ('international', 'Tarifario internacional'),
+        ('national', 'Tarifario nacional'),
+    ], string='Tarifario', default='international', required=True)
+    file = fields.Binary(string='Archivo (CSV / XLSX)', required=True)
+    filename = fields.Char(string='Nombre del archivo')
+    create_partners = fields.Boolean(
+        string='Crear partners faltantes',
+        help='Si un forwarder/naviera/puerto no existe, se crea ya etiquetado. '
+             'Sin marcar, la fila se reporta como error.',
+    )
+    chunk_size = fields.Integer(string='Tamaño de bloque', default=500)
+
+    state = fields.Selection([('draft', 'Borrador'), ('done', 'Importado')], default='draft')
+    imported_count = fields.Integer(string='Filas importadas', readonly=True)
+    error_count = fields.Integer(string='Filas con error', readonly=True)
+    error_log = fields.Text(string='Errores', readonly=True)
+
+    # ==========================
+    # LECTURA EN STREAMING
+    # ==========================
+
+    def _iter_rows(self):
+        """Filas del archivo como dicts {encabezado normalizado: valor}, con
+        su número de fila (1 = encabezado)."""
+        data = base64.b64decode(self.file)
+        if (self.filename or '').lower().endswith(('.xlsx', '.xlsm')):
+            if openpyxl is None:
+                raise UserError(_("Para importar XLSX se requiere la librería openpyxl."))
+            workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+            rows = workbook.active.iter_rows(values_only=True)
+        else:
+            text = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig', newline='')
+            sample = text.read(4096)
+            text.seek(0)
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters=',;\t|')
+            except csv.Error:
+                dialect = csv.excel
+            rows = csv.reader(text, dialect)
+        headers = [_normalize(h) for h in next(rows, [])]
+        for row_number, row in enumerate(rows, start=2):
+            if not any(v not in (None, '') for v in row):
+                continue
+            yield row_number, dict(zip(headers, row))
+
+    def _chunks(self):
+        size = max(self.chunk_size or 500, 1)
+        chunk = []
+        for item in self._iter_rows():
+            chunk.append(item)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    # ==========================
+    # MAPAS DE RESOLUCIÓN
+    # ==========================
+
+    def _build_static_maps(self):
+        """Países, meses y equipos: catálogos chicos, UNA lectura cada uno."""
+        countries = {}
+        for country in self.env['res.country'].search([]):
+            countries[_normalize(country.code)] = country.id
+            countries[_normalize(country.name)] = country.id
+        months = {}
+        for month in self.env['freight.tariff.month'].search([]):
+            months[_normalize(month.code)] = month.id
+            months[_normalize(month.code).lstrip('0')] = month.id
+            months[_normalize(month.name)] = month.id
+        equipos = {}
+        for code, label in self.env['freight.tariff']._fields['equipo'].selection:
+            equipos[_normalize(code)] = code
+            equipos[_normalize(label)] = code
+        vehicles = {}
+        for code, label in self.env['freight.tariff.national']._fields['vehicle_type'].selection:
+            vehicles[_normalize(code)] = code
+            vehicles[_normalize(label)] = code
+        return {'country': countries, 'month': months, 'equipo': equipos, 'vehicle': vehicles}
+
+    def _resolve_partners(self, names_by_tag, partner_map):
+        """Completa partner_map {(etiqueta, nombre normalizado): id} con los
+        nombres aún no vistos, en UNA búsqueda por bloque vía ORM (respeta
+        las reglas de registro). La coincidencia es por nombre normalizado
+        (sin mayúsculas ni acentos, la misma llave del mapa); entre
+        homónimos gana el que ya lleva la etiqueta y luego el más antiguo.
+        Los encontrados se etiquetan aquí; si se pidió, los faltantes se
+        crean UNA vez por nombre normalizado, ya con sus etiquetas."""
+        Partner = self.env['res.partner']
+        missing = {}  # nombre normalizado -> (nombre tal cual, {etiquetas})
+        for tag_name, names in names_by_tag.items():
+            for name in names:
+                name = str(name).strip()
+                key = _normalize(name)
+                if key and (tag_name, key) not in partner_map:
+                    missing.setdefault(key, (name, set()))[1].add(tag_name)
+        if not missing:
+            return
+        # Prefiltro en SQL (=ilike sobre el nombre tal cual y normalizado);
+        # la igualdad exacta de la llave se decide en Python.
+        patterns = {escape_psql(v) for name, _tags in missing.values() for v in (name, _normalize(name))}
+        domain = ['|'] * (len(patterns) - 1) + [('name', '=ilike', p) for p in patterns]
+        candidates = {}
+        for partner in Partner.search_fetch(domain, ['name', 'category_id'], order='id'):
+            key = _normalize(partner.name)
+            if key in missing:
+                candidates.setdefault(key, []).append(partner)
+
+        to_tag = {tag_name: set() for tag_name in names_by_tag}
+        to_create = []
+        for key, (name, tag_names) in missing.items():
+            if key not in candidates:
+                to_create.append((name, tag_names))
+                continue
+            for tag_name in tag_names:
+                tag = Partner._tarifario_get_tag(tag_name)
+                partner = next((p for p in candidates[key] if tag in p.category_id), candidates[key][0])
+                partner_map[(tag_name, key)] = partner.id
+                to_tag[tag_name].add(partner.id)
+        Partner.sudo()._tarifario_assign_tags(to_tag)
+
+        if to_create and self.create_partners:
+            partners = Partner.create([{
+                'name': name,
+                'is_company': True,
+                'category_id': [(4, Partner._tarifario_get_tag(tag_name).id) for tag_name in tag_names],
+            } for name, tag_names in to_create])
+            for partner, (name, tag_names) in zip(partners, to_create):
+                for tag_name in tag_names:
+                    partner_map[(tag_name, _normalize(name))] = partner.id
+
+    # ==========================
+    # CONVERSIÓN DE FILAS
+    # ==========================
+
+    def _row_to_vals(self, row, maps, partner_map, headers):
+        vals = {}
+        for header, value in row.items():
+            field = headers.get(header)
+            if not field or value in (None, ''):
+                continue
+            if field == 'country_id':
+                country_id = maps['country'].get(_normalize(value))
+                if not country_id:
+                    raise ValueError(_("País desconocido: %s", value))
+                vals[field] = country_id
+            elif field in _PARTNER_TAG_FIELDS:
+                partner_id = partner_map.get((_PARTNER_TAG_FIELDS[field], _normalize(value)))
+                if not partner_id:
+                    raise ValueError(_("%(tag)s desconocido: %(name)s",
+                                       tag=_PARTNER_TAG_FIELDS[field], name=value))
+                vals[field] = partner_id
+            elif field == 'mes_ids':
+                month_ids = []
+                for token in str(value).replace(';', ',').replace('/', ',').split(','):
+                    token = _normalize(token)
+                    if not token:
+                        continue
+                    month_id = maps['month'].get(token) or maps['month'].get(token.lstrip('0'))
+                    if not month_id:
+                        raise ValueError(_("Mes desconocido: %s", token))
+                    month_ids.append(month_id)
+                vals[field] = [(6, 0, month_ids)]
+            elif field == 'equipo':
+                code = maps['equipo'].get(_normalize(value))
+                if not code:
+                    raise ValueError(_("Equipo desconocido: %s", value))
+                vals[field] = code
+            elif field == 'vehicle_type':
+                code = maps['vehicle'].get(_normalize(value))
+                if not code:
+                    raise ValueError(_("Tipo de vehículo desconocido: %s", value))
+                vals[field] = code
+            elif field == 'anio':
+                vals[field] = str(int(_to_float(value)))
+            elif field in _FLOAT_FIELDS:
+                vals[field] = _to_float(value)
+            elif field in _INT_FIELDS:
+                vals[field] = int(_to_float(value))
+            else:
+                vals[field] = str(value).strip()
+        return vals
+
+    # ==========================
+    # IMPORTACIÓN
+    # ==========================
+
+    def action_import(self):
+        self.ensure_one()
+        national = self.target == 'national'
+        headers = _NATIONAL_HEADERS if national else _INTERNATIONAL_HEADERS
+        Model = self.env['freight.tariff.national' if national else 'freight.tariff'].with_context(
+            tarifario_skip_partner_tag=True,
+            mail_create_nolog=True,
+            mail_create_nosubscribe=True,
+        )
+        maps = self._build_static_maps()
+        partner_map = {}
+        errors = []
+        imported = 0
+
+        for chunk in self._chunks():
+            if not national:
+                names_by_tag = {tag: set() for tag in _PARTNER_TAG_FIELDS.values()}
+                for _row_number, row in chunk:
+                    for header, field in headers.items():
+                        if field in _PARTNER_TAG_FIELDS and row.get(header) not in (None, ''):
+                            names_by_tag[_PARTNER_TAG_FIELDS[field]].add(row[header])
+                self._resolve_partners(names_by_tag, partner_map)
+            batch = []
+            for row_number, row in chunk:
+                try:
+                    batch.append((row_number, self._row_to_vals(row, maps, partner_map, headers)))
+                except (ValueError, TypeError) as e:
+                    errors.append(_("Fila %(row)s: %(error)s", row=row_number, error=e))
+            created = self._create_batch(Model, batch, errors)
+            imported += len(created)
+
+        _logger.info(
+            "[TARIFARIO] Importación %s (%s): %s fila(s) importadas, %s con error.",
+            self.filename, self.target, imported, len(errors),
+        )
+        self.write({
+            'state': 'done',
+            'imported_count': imported,
+            'error_count': len(errors),
+            'error_log': '\n'.join(errors),
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def _create_batch(self, Model, batch, errors):
+        """create() en lote dentro de un savepoint; si el lote falla, se
+        reintenta fila por fila para reportar SOLO las filas culpables.
+        Devuelve los vals efectivamente creados."""
+        if not batch:
+            return []
+        try:
+            with self.env.cr.savepoint():
+                Model.create([vals for _row_number, vals in batch])
+            return [vals for _row_number, vals in batch]
+        except Exception:
+            _logger.info("[TARIFARIO] Bloque de importación con errores: se reintenta fila por fila.")
+        created = []
+        for row_number, vals in batch:
+            try:
+                with self.env.cr.savepoint():
+                    Model.create([vals])
+                created.append(vals)
+            except Exception as e:
+                errors.append(_("Fila %(row)s: %(error)s", row=row_number, error=e))
+        return created